@@ -0,0 +1,293 @@
+'''
+mock_server.py
+Create date: 20261017
+Version: 0.1
+
+Local stand-in for the SIS web services, used by the benchmarks.
+Serves synthetic JSON:API pages for site-epochs, equipment-installations (with siteepoch
+and equipment relationships), sites (with sitelabels and place relationships and included
+blocks) and fdsnws/channel, plus the detail page of each record. Supports the multivalue filters, isactive,
+_gte/_lte filters, sort and paging. The latency of each response and throttling
+(429 with Retry-After) are configurable.
+'''
+
+import json
+import math
+import socket
+import time
+import random
+import threading
+import datetime as dt
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+
+ENDPOINTS = ('site-epochs', 'equipment-installations', 'sites', 'fdsnws/channel')
+
+NETCODES = ('CI', 'BK', 'NC', 'UW', 'NN', 'AZ')
+SITETYPES = ('seismic', 'seismic, strong motion', 'strong motion', 'gnss', 'seismic, vsat')
+CATEGORIES = (('Sensor', 'Broadband'), ('Sensor', 'Accelerometer'), ('Datalogger', 'Datalogger'),
+              ('Telemetry', 'Radio'), ('Power', 'Battery'))
+LABELS = ('ShakeAlert', 'ANSS', 'Backbone', 'Urban', 'Borehole', 'Temporary')
+CHANNELS = ('HHZ', 'HHN', 'HHE', 'HNZ', 'HNN', 'HNE')
+
+def isodate(d):
+    return d.isoformat() if d is not None else None
+
+def make_dataset(size=10000, seed=1):
+    '''
+    Build the synthetic records of every endpoint. size is the number of site epochs.
+    The other endpoints are sized relative to it. Returns a dict of endpoint to the list of
+    JSON:API resources, plus 'included' with the site labels and places.
+    Timestamps repeat across records, as in real epoch histories.
+    '''
+    rng = random.Random(seed)
+    start = dt.datetime(1990, 1, 1, tzinfo=dt.UTC)
+    # a limited pool of timestamps, so many records share them
+    dates = sorted(start + dt.timedelta(days=rng.randrange(0, 12000)) for _ in range(max(10, size // 20)))
+
+    def epoch():
+        ondate = rng.choice(dates)
+        offdate = None if rng.random() < 0.4 else min(ondate + dt.timedelta(days=rng.randrange(30, 4000)),
+                                                       dt.datetime(2030, 1, 1, tzinfo=dt.UTC))
+        return ondate, offdate
+
+    nsites = max(1, size // 3)
+    places = [dict(type='Place', id=str(i + 1), attributes=dict(placename=f'Place {i + 1}', state='CA', country='USA'))
+              for i in range(max(1, nsites // 20))]
+    labels = [dict(type='SiteLabel', id=str(i + 1), attributes=dict(labelname=name, namespace='network'))
+              for i, name in enumerate(LABELS)]
+
+    sites = []
+    for i in range(nsites):
+        netcode = NETCODES[i % len(NETCODES)]
+        sitelabels = rng.sample(labels, rng.randrange(0, 3))
+        place = places[i % len(places)]
+        sites.append(dict(type='Site', id=str(i + 1),
+            attributes=dict(netcode=netcode, lookupcode=f'S{i:05d}', sitename=f'Site {i}', isactive=True),
+            relationships=dict(
+                sitelabels=dict(data=[dict(type='SiteLabel', id=lbl['id']) for lbl in sitelabels]),
+                place=dict(data=dict(type='Place', id=place['id'])),
+                network=dict(data=dict(type='Network', id=str(NETCODES.index(netcode) + 1)))),
+            links=dict(self=f'/sites/{i + 1}')))
+
+    siteepochs = []
+    for i in range(size):
+        site = sites[i % nsites]
+        ondate, offdate = epoch()
+        siteepochs.append(dict(type='SiteEpoch', id=str(i + 1),
+            attributes=dict(netcode=site['attributes']['netcode'], lookupcode=site['attributes']['lookupcode'],
+                            operatorcode=site['attributes']['netcode'],
+                            latitude=str(round(32 + rng.random() * 10, 5)), longitude=str(round(-124 + rng.random() * 10, 5)),
+                            elevation=str(round(rng.random() * 3000, 1)),
+                            ondate=isodate(ondate), offdate=isodate(offdate),
+                            sitetypes=rng.choice(SITETYPES), telemetrytypes=rng.choice(('vsat', 'radio', 'cell', None))),
+            relationships=dict(site=dict(data=dict(type='Site', id=site['id']))),
+            links=dict(self=f'/site-epochs/{i + 1}')))
+
+    installations = []
+    for i in range(size * 2):
+        siteepoch = siteepochs[i % size]
+        se = siteepoch['attributes']
+        categorygroup, category = rng.choice(CATEGORIES)
+        ondate, offdate = epoch()
+        installations.append(dict(type='EquipmentInstallation', id=str(i + 1),
+            attributes=dict(netcode=se['netcode'], lookupcode=se['lookupcode'], categorygroup=categorygroup,
+                            category=category, modelname=f'Model {rng.randrange(40)}', serialnumber=f'SN{i:07d}',
+                            ondate=isodate(ondate), offdate=isodate(offdate),
+                            xcoord=str(rng.random()), ycoord=str(rng.random()), zcoord=str(rng.random())),
+            relationships=dict(siteepoch=dict(data=dict(type='SiteEpoch', id=siteepoch['id'])),
+                               equipment=dict(data=dict(type='Equipment', id=str(i + 1)))),
+            links=dict(self=f'/equipment-installations/{i + 1}')))
+
+    channels = []
+    for i in range(size * 3):
+        se = siteepochs[(i // len(CHANNELS)) % size]['attributes']
+        ondate, offdate = epoch()
+        channels.append(dict(type='FdsnwsChannel', id=str(i + 1),
+            attributes=dict(net=se['netcode'], sta=se['lookupcode'], loc='--', cha=CHANNELS[i % len(CHANNELS)],
+                            latitude=se['latitude'], longitude=se['longitude'], elevation=se['elevation'],
+                            samplerate=100.0, ondate=isodate(ondate), offdate=isodate(offdate))))
+
+    return {'site-epochs': siteepochs, 'equipment-installations': installations, 'sites': sites,
+            'fdsnws/channel': channels, 'included': {('SiteLabel', l['id']): l for l in labels} |
+                                                    {('Place', p['id']): p for p in places}}
+
+def _sort_value(val):
+    if type(val) == str:
+        val = val.lower()
+    return (val is None, val if val is not None else 0)
+
+class MockSISServer(object):
+    '''
+    Threaded HTTP server with the synthetic dataset. Use as a context manager:
+
+        with MockSISServer(size=10000) as server:
+            client = SISClient(server.baseurl, 'token')
+
+    page_size is the default page size. latency is the seconds added to each response.
+    Every throttle_every-th request is answered with 429 and Retry-After: retry_after.
+    '''
+
+    def __init__(self, size=10000, page_size=500, latency=0.0, throttle_every=0, retry_after=0.1, seed=1, port=0):
+        self.size = size
+        self.page_size = page_size
+        self.latency = latency
+        self.throttle_every = throttle_every
+        self.retry_after = retry_after
+        self.data = make_dataset(size, seed)
+        self.index = {k: {r['id']: r for r in v} for k, v in self.data.items() if k in ENDPOINTS}
+        self.requests = 0
+        self._queries = {}
+        self._lock = threading.Lock()
+        self._httpd = ThreadingHTTPServer(('127.0.0.1', port), self._handler())
+        self._httpd.daemon_threads = True
+        self._thread = None
+
+    @property
+    def baseurl(self):
+        return f'http://127.0.0.1:{self._httpd.server_port}'
+
+    def start(self):
+        self._thread = threading.Thread(target=self._httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+    def _count_request(self):
+        ''' Returns True if this request is throttled '''
+        with self._lock:
+            self.requests += 1
+            return self.throttle_every > 0 and self.requests % self.throttle_every == 0
+
+    def _handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, *args):
+                pass
+
+            def setup(self):
+                super().setup()
+                # the headers and the body are written separately, do not let Nagle delay the body
+                self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+            def do_GET(self):
+                if server.latency:
+                    time.sleep(server.latency)
+                if server._count_request():
+                    return self._send(429, {'errors': [{'status': '429', 'title': 'Too Many Requests'}]},
+                                      {'Retry-After': str(server.retry_after)})
+                url = urlparse(self.path)
+                params = {k: v[0] for k, v in parse_qs(url.query).items()}
+                path = url.path.strip('/')
+                endpoint, _, id = path.rpartition('/')
+                if endpoint in ENDPOINTS and id.isdigit():
+                    rec = server.index[endpoint].get(id, None)
+                    if rec is None:
+                        return self._send(404, {'errors': [{'status': '404', 'title': 'Not Found'}]})
+                    return self._send(200, server.document(endpoint, [rec]) | {'data': rec})
+                if path not in ENDPOINTS:
+                    return self._send(404, {'errors': [{'status': '404', 'title': 'Not Found'}]})
+                self._send(200, server.page(path, params))
+
+            def _send(self, status, doc, headers={}):
+                body = json.dumps(doc).encode()
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/vnd.api+json')
+                self.send_header('Content-Length', str(len(body)))
+                for k, v in headers.items():
+                    self.send_header(k, v)
+                self.end_headers()
+                self.wfile.write(body)
+
+        return Handler
+
+    def changed(self):
+        ''' Forget the results kept per query. Call after changing data or index '''
+        with self._lock:
+            self._queries.clear()
+
+    def document(self, endpoint, records):
+        ''' The included block for the records of a page, for the endpoints that have one '''
+        if endpoint != 'sites':
+            return {}
+        included = {}
+        for rec in records:
+            for rel in rec.get('relationships', {}).values():
+                data = rel['data']
+                for ident in data if type(data) == list else [data]:
+                    key = (ident['type'], ident['id'])
+                    if key in self.data['included']:
+                        included[key] = self.data['included'][key]
+        return {'included': list(included.values())}
+
+    def page(self, endpoint, params):
+        ''' Filter, sort and page the records of endpoint '''
+        records = self._query(endpoint, params)
+        size = int(params.get('page[size]', self.page_size))
+        number = int(params.get('page[number]', 1))
+        pages = max(1, math.ceil(len(records) / size))
+        data = records[(number - 1) * size:number * size]
+        return dict(data=data, meta=dict(pagination=dict(count=len(records), page=number, pages=pages))) | self.document(endpoint, data)
+
+    def _query(self, endpoint, params):
+        ''' The filtered and sorted records. Kept per query so paging through them stays cheap '''
+        key = (endpoint, tuple(sorted((k, v) for k, v in params.items() if k not in ('page[number]', 'page[size]'))))
+        with self._lock:
+            records = self._queries.get(key, None)
+        if records is not None:
+            return records
+
+        records = self.data[endpoint]
+        for k, v in params.items():
+            if k in ('page[number]', 'page[size]', 'sort', 'format'):
+                continue
+            match = self._matcher(k, v)
+            records = [r for r in records if match(r['attributes'])]
+        sort = params.get('sort', None)
+        if sort:
+            for name in reversed(sort.split(',')):
+                desc = name.startswith('-')
+                attr = name.lstrip('-').split('.')[-1]
+                records = sorted(records, key=lambda r: _sort_value(r['attributes'].get(attr, None)), reverse=desc)
+        with self._lock:
+            if len(self._queries) >= 64:
+                self._queries.clear()
+            self._queries[key] = records
+        return records
+
+    @staticmethod
+    def _matcher(k, v):
+        ''' Returns a function of the attributes of a record that applies the filter k=v '''
+        if k == 'isactive':
+            active = v.lower() in ('yes', 'true', '1')
+            now = dt.datetime.now(dt.UTC).isoformat()
+            return lambda attributes: (attributes.get('offdate', None) is None or attributes['offdate'] > now) == active
+        attr, _, op = k.rpartition('_')
+        if op in ('gte', 'lte'):
+            numeric = attr in ('latitude', 'longitude', 'elevation')
+            bound = float(v) if numeric else v
+            def compare(attributes):
+                val = attributes.get(attr, None)
+                if val is None:
+                    return False
+                val = float(val) if numeric else val
+                return val >= bound if op == 'gte' else val <= bound
+            return compare
+        if op == 'icontains':
+            v = v.lower()
+            return lambda attributes: v in str(attributes.get(attr, None) or '').lower()
+        values = {x.lower() for x in v.split(',')}
+        # filters on attributes the records do not have are ignored
+        return lambda attributes: k not in attributes or str(attributes[k]).lower() in values
@@ -0,0 +1,188 @@
+'''
+run_benchmarks.py
+Create date: 20261017
+Version: 0.1
+
+End to end benchmarks of simple_sis_api against the local mock server (mock_server.py).
+Each scenario runs get_filtered_list, iter_filtered, get_columns, get_by_id or get_many
+and reports records per second, peak memory (tracemalloc) and the time spent in each
+stage (network, decode, flatten, filter, sort) from a StatsCollector.
+
+    python3 benchmarks/run_benchmarks.py --size 20000 --page-size 500 --latency 0.01
+    python3 benchmarks/run_benchmarks.py --save baseline.json
+    python3 benchmarks/run_benchmarks.py --compare baseline.json --tolerance 0.2
+
+With --compare, the exit code is 1 if the records per second of any scenario dropped
+by more than the tolerance.
+'''
+
+import os
+import sys
+import gc
+import json
+import time
+import argparse
+import tracemalloc
+import statistics
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from simple_sis_api import (SISClient, RetryPolicy, StatsCollector, SiteEpoch, EquipmentInstallation, Site)
+from simple_sis_api.classes import FdsnwsChannel
+from simple_sis_api.columnar import np
+from mock_server import MockSISServer
+
+def scenarios(args):
+    '''
+    List of (name, function). Each function takes a SISClient and returns the number of records.
+    '''
+    page = {'page[size]': args.page_size}
+
+    def endpoint(cls, client):
+        ep = cls(client=client)
+        ep.max_page_workers = args.page_workers
+        return ep
+
+    def site_epochs(client):
+        return len(endpoint(SiteEpoch, client).get_filtered_list(dict(page)))
+
+    def site_epochs_client_filters(client):
+        filterby = page | {'sitetypes_q': 'seismic', 'ondate_lte': '2010-01-01T00:00:00+00:00',
+                           'offdate_gte': '2005-01-01T00:00:00+00:00'}
+        return len(endpoint(SiteEpoch, client).get_filtered_list(filterby))
+
+    def site_epochs_stream(client):
+        return sum(1 for _ in endpoint(SiteEpoch, client).iter_filtered(dict(page)))
+
+    def site_epochs_columns(client):
+        cols = endpoint(SiteEpoch, client).get_columns(dict(page), format='numpy' if np is not None else 'dict')
+        return len(cols['id'])
+
+    def installations(client):
+        return len(endpoint(EquipmentInstallation, client).get_filtered_list(page | {'netcode': ['CI', 'BK', 'NC']}))
+
+    def sites(client):
+        return len(endpoint(Site, client).get_filtered_list(dict(page)))
+
+    def channels(client):
+        return len(endpoint(FdsnwsChannel, client).get_filtered_list(dict(page)))
+
+    ids = list(range(1, min(args.ids, args.size) + 1))
+
+    def by_id(client):
+        se = endpoint(SiteEpoch, client)
+        return sum(1 for id in ids if se.get_by_id(id))
+
+    def many(client):
+        results, errors = endpoint(SiteEpoch, client).get_many(ids)
+        return len(results)
+
+    return [('site-epochs', site_epochs),
+            ('site-epochs client filters', site_epochs_client_filters),
+            ('site-epochs iter_filtered', site_epochs_stream),
+            ('site-epochs get_columns', site_epochs_columns),
+            ('equipment-installations', installations),
+            ('sites with included', sites),
+            ('fdsnws/channel', channels),
+            ('site-epochs get_by_id', by_id),
+            ('site-epochs get_many', many)]
+
+def run_scenario(server, func, repeat, pool_size):
+    '''
+    Run func repeat times for the timings, then once more under tracemalloc for the peak memory.
+    Returns a dict of the results.
+    '''
+    times = []
+    stats = StatsCollector()
+    records = 0
+    for _ in range(repeat):
+        with SISClient(server.baseurl, 'benchmark', pool_size=pool_size, instrumentation=stats,
+                       retry=RetryPolicy(max_retries=10)) as client:
+            gc.collect()
+            start = time.perf_counter()
+            records = func(client)
+            times.append(time.perf_counter() - start)
+
+    with SISClient(server.baseurl, 'benchmark', pool_size=pool_size, retry=RetryPolicy(max_retries=10)) as client:
+        gc.collect()
+        tracemalloc.start()
+        func(client)
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+    best = min(times)
+    stages = {}
+    requests = retries = 0
+    for label, s in stats.to_dict().items():
+        requests += s['requests']
+        retries += s['retries']
+        for stage, st in s['stages'].items():
+            stages[stage] = stages.get(stage, 0) + st['seconds'] / repeat
+    return dict(records=records, seconds=best, median_seconds=statistics.median(times),
+                records_per_sec=records / best if best else 0, peak_mb=peak / 2**20,
+                requests=requests // repeat, retries=retries // repeat, stages=stages)
+
+def print_report(results):
+    stage_names = ('network', 'decode', 'flatten', 'filter', 'sort')
+    header = f'{"scenario":30} {"records":>8} {"best s":>8} {"rec/s":>10} {"peak MB":>8} {"reqs":>5} {"retry":>5} ' + \
+             ' '.join(f'{name:>8}' for name in stage_names)
+    print(header)
+    print('-' * len(header))
+    for name, r in results.items():
+        stages = ' '.join(f'{r["stages"].get(stage, 0):8.3f}' for stage in stage_names)
+        print(f'{name:30} {r["records"]:8d} {r["seconds"]:8.3f} {r["records_per_sec"]:10.0f} {r["peak_mb"]:8.1f} '
+              f'{r["requests"]:5d} {r["retries"]:5d} {stages}')
+    print('stage columns are seconds per run, summed over the threads')
+
+def compare(results, baseline, tolerance):
+    ''' Returns the list of scenarios whose records per second dropped by more than tolerance '''
+    regressions = []
+    for name, r in results.items():
+        base = baseline.get(name, None)
+        if not base or not base['records_per_sec']:
+            continue
+        change = r['records_per_sec'] / base['records_per_sec'] - 1
+        flag = 'REGRESSION' if change < -tolerance else ''
+        print(f'{name:30} {base["records_per_sec"]:10.0f} -> {r["records_per_sec"]:10.0f} rec/s ({change:+.1%}) {flag}')
+        if flag:
+            regressions.append(name)
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark simple_sis_api against a local mock SIS server')
+    parser.add_argument('--size', type=int, default=10000, help='number of site epochs. Installations are 2x, channels 3x')
+    parser.add_argument('--page-size', type=int, default=500)
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds added to each response')
+    parser.add_argument('--throttle-every', type=int, default=0, help='answer every nth request with 429')
+    parser.add_argument('--retry-after', type=float, default=0.05, help='Retry-After of the throttled responses')
+    parser.add_argument('--page-workers', type=int, default=1, help='max_page_workers of the endpoints')
+    parser.add_argument('--pool-size', type=int, default=10)
+    parser.add_argument('--ids', type=int, default=200, help='number of ids for get_by_id and get_many')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--scenario', action='append', help='run only the scenarios containing this text')
+    parser.add_argument('--save', help='save the results to this json file')
+    parser.add_argument('--compare', help='compare with the results saved in this json file')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='allowed drop in records per second with --compare')
+    args = parser.parse_args()
+
+    print(f'Building {args.size} site epochs ...')
+    with MockSISServer(size=args.size, page_size=args.page_size, latency=args.latency,
+                       throttle_every=args.throttle_every, retry_after=args.retry_after) as server:
+        results = {}
+        for name, func in scenarios(args):
+            if args.scenario and not any(s in name for s in args.scenario):
+                continue
+            results[name] = run_scenario(server, func, args.repeat, args.pool_size)
+    print_report(results)
+
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump(dict(args=vars(args), results=results), f, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)['results']
+        if compare(results, baseline, args.tolerance):
+            sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -34,5 +34,6 @@ setup(
     ],
     packages=["simple_sis_api"],
     include_package_data=True,
-    install_requires=["requests"]
+    install_requires=["requests"],
+    extras_require={"async": ["aiohttp"], "columnar": ["numpy", "pandas"], "fast": ["orjson"]}
 )
\ No newline at end of file
@@ -1,6 +1,20 @@
-from .utils import (parsedate, FUTURE_OFF_DATE, ATTR_DATATYPE_MAPPING)
+from .utils import (parsedate, parsedate_cached, DATE_PARSERS, FUTURE_OFF_DATE, ATTR_DATATYPE_MAPPING, sort_key)
+from .cache import (CacheBackend, SQLiteCache, CacheMissError, )
+from .memo import (QueryCache, InflightQueries, )
+from .ratelimit import (RateLimiter, RetryPolicy, )
+from .stats import (Instrumentation, StatsCollector, )
+from .client import (SISClient, )
+from .aio import (AsyncSISClient, )
+from .filters import (ClientFilter, )
+from .columnar import (ColumnBuilder, )
+from .records import (Record, RecordFactory, )
 from .base import (APIBase, )
 from .classes import (SiteEpoch, EquipmentInstallation, SiteLabelGroup, SiteLabel,
                 SiteLog, Site, Equipment, EquipmentCategory, EquipmentModel,
                 EquipmentLog, EquipmentProblem, Network, Organization, Place,
                 TelemetryConnection, TelemetryNode, )
+from .sync import (EndpointMirror, )
+from .snapshot import (SnapshotStore, )
+from .spatial import (SpatialIndex, haversine_km, )
+from .intervals import (IntervalIndex, )
+from .join import (EndpointJoin, hash_join, )
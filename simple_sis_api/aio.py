@@ -0,0 +1,160 @@
+'''
+aio.py
+Create date: 20261017
+Version: 0.1
+
+asyncio transport used by the aget_* methods of the endpoint classes.
+Requires aiohttp. Install with: python3 -m pip install simple_sis_api[async]
+'''
+
+import time
+import asyncio
+import threading
+import logging
+
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
+from .client import DEFAULT_POOL_SIZE, read_token
+from .ratelimit import RetryPolicy
+from .decoding import loads
+from .stats import timed
+
+logger = logging.getLogger(__name__)
+
+class AsyncSISClient(object):
+    '''
+    Holds one pooled aiohttp.ClientSession for a SIS instance (baseurl) and api token.
+    An aiohttp session is bound to the event loop it was created on, so the shared
+    clients are kept per (baseurl, token, event loop).
+    Use it as an async context manager to close the pooled connections when done.
+    rate_limiter, retry and instrumentation work as in SISClient. Share the RateLimiter of a SISClient 
+    to share its budget.
+    '''
+
+    logger = logger
+
+    # registry of shared clients. key is (baseurl, token, loop)
+    _shared = {}
+    _shared_lock = threading.Lock()
+
+    def __init__(self, baseurl, token, pool_size=DEFAULT_POOL_SIZE, rate_limiter=None, retry=None, instrumentation=None):
+        if aiohttp is None:
+            raise ImportError('aiohttp is required for the async api. Install it with: python3 -m pip install aiohttp')
+        self.baseurl = baseurl.rstrip('/')
+        self.token = token
+        self.pool_size = pool_size
+        self.rate_limiter = rate_limiter
+        self.retry = retry if retry is not None else RetryPolicy()
+        self.instrumentation = instrumentation
+        self.auth_header = {'Authorization': f'Bearer {token}',}
+        self.closed = False
+        self._session = None
+        self._loop = None
+
+    @classmethod
+    def from_tokenfile(cls, baseurl, tokenfp, **kw):
+        ''' Read the token from tokenfp and create a new client '''
+        return cls(baseurl, read_token(tokenfp), **kw)
+
+    @classmethod
+    def shared(cls, baseurl, token, pool_size=DEFAULT_POOL_SIZE, rate_limiter=None, retry=None, instrumentation=None):
+        '''
+        Returns the client shared by all the endpoints using this baseurl and token
+        on the running event loop. Must be called from a coroutine.
+        pool_size, rate_limiter, retry and instrumentation are only used when a new client is created.
+        '''
+        loop = asyncio.get_running_loop()
+        key = (baseurl.rstrip('/'), token, loop)
+        with cls._shared_lock:
+            # drop the clients of loops that are gone
+            for k in [k for k in cls._shared if k[2].is_closed()]:
+                del cls._shared[k]
+            client = cls._shared.get(key)
+            if client is None or client.closed:
+                client = cls(baseurl, token, pool_size=pool_size, rate_limiter=rate_limiter, retry=retry,
+                             instrumentation=instrumentation)
+                cls._shared[key] = client
+            return client
+
+    @classmethod
+    async def close_all(cls):
+        ''' Close all the shared clients of the running event loop. Call before the loop ends. '''
+        loop = asyncio.get_running_loop()
+        with cls._shared_lock:
+            clients = [c for k, c in cls._shared.items() if k[2] is loop]
+        for client in clients:
+            await client.close()
+
+    def _get_session(self):
+        if self._session is None:
+            connector = aiohttp.TCPConnector(limit=self.pool_size)
+            self._session = aiohttp.ClientSession(headers=self.auth_header, connector=connector)
+            self._loop = asyncio.get_running_loop()
+        return self._session
+
+    async def get(self, url, params=None, label='other'):
+        '''
+        Send a GET request over the pooled session.
+        Raises aiohttp.ClientResponseError for error responses. Returns the decoded json document.
+        label is the endpoint class name reported to the instrumentation.
+        '''
+        if params:
+            # aiohttp only accepts str, int and float values. requests converts the rest with str()
+            params = {k: v if type(v) in (str, int, float) else str(v) for k, v in params.items()}
+        inst = self.instrumentation
+        attempt = 0
+        while True:
+            if self.rate_limiter is not None:
+                await self.rate_limiter.acquire_async()
+            if inst is not None:
+                start = time.perf_counter()
+            try:
+                async with self._get_session().get(url, params=params) as r:
+                    content = await r.read()
+                    if inst is not None:
+                        inst.request(label, url, r.status, time.perf_counter() - start, len(content))
+                    if not self.retry.should_retry(attempt, r.status):
+                        r.raise_for_status()
+                        with timed(inst, label, 'decode'):
+                            return loads(content)
+                    if inst is not None:
+                        inst.retry(label, url, r.status)
+                    retry_after = r.headers.get('Retry-After', None)
+                    delay = self.retry.delay(attempt, retry_after)
+                    if retry_after is not None and self.rate_limiter is not None:
+                        self.rate_limiter.pause(delay)
+                    self.logger.warning(f'Request to {url} returned {r.status}. Retrying in {delay:.1f}s')
+            except (aiohttp.ClientConnectionError, asyncio.TimeoutError) as e:
+                if inst is not None:
+                    inst.request(label, url, None, time.perf_counter() - start, 0)
+                if not self.retry.should_retry(attempt):
+                    raise
+                if inst is not None:
+                    inst.retry(label, url, None)
+                delay = self.retry.delay(attempt)
+                self.logger.warning(f'Request to {url} failed: {e}. Retrying in {delay:.1f}s')
+            await asyncio.sleep(delay)
+            attempt += 1
+
+    async def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        if self._session is not None:
+            await self._session.close()
+        with self._shared_lock:
+            key = (self.baseurl, self.token, self._loop)
+            if self._shared.get(key) is self:
+                del self._shared[key]
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self.close()
+
+    def __repr__(self):
+        return f'{self.__class__.__name__}({self.baseurl!r}, pool_size={self.pool_size})'
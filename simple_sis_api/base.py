@@ -6,14 +6,32 @@ Version: 0.1
 
 '''
 
-import requests
 import os
-from collections import defaultdict
+import heapq
+import queue
+import threading
+from itertools import islice
+from collections import defaultdict, deque
+from concurrent.futures import ThreadPoolExecutor
+import asyncio
 import logging
 import simple_sis_api as ssa
+from .client import SISClient, read_token, DEFAULT_POOL_SIZE
+from .aio import AsyncSISClient
+from .filters import ClientFilter, OR_KEY, is_allowed
+from .columnar import ColumnBuilder
+from .records import RecordFactory
+from .memo import freeze
+from .utils import sort_key
+from .planner import plan_query, merge_results
+from .decoding import compile_caster
+from .stats import timed
 
 logger = logging.getLogger(__name__)
 
+# Number of records a fan_out query hands to the merge at a time, when the query has no page size
+FANOUT_BATCH_SIZE = 500
+
 class APIBase(object):
     '''
     Base class to access the SIS webservice endpoints. 
@@ -31,32 +49,446 @@ class APIBase(object):
     allowed_multivalue_filters = []
     # all possible single value filters for this endpoint. 
     allowed_filters = ['page[number]', 'page[size]', 'sort']
+    # client side filters for this endpoint. The other filter types on the same attributes 
+    # can be used too, e.g. ondate_gt and ondate_in when ondate_gte is listed (see filters.is_allowed)
     allowed_client_filters = []
     # Default values if applicable
     default_filters = {'page[number]': 1, 'page[size]':500 }
     default_sort = []
+    # How to project related objects into the flattened element. 
+    # key is the relationship name, value is a dict with
+    #   attr: attribute of the related object to use, or 'id'
+    #   name: key used in the flattened element. Defaults to the relationship name
+    #   join: for to-many relationships, join the values with this separator. 
+    #         Without it, the values are returned as a list.
+    relationship_fields = {}
+    # Set to True to return compact Record objects (see records.py) instead of a dict per element.
+    # Records have dict like access and use much less memory for large results.
+    compact_records = False
+    # Seconds to keep the responses of this endpoint when the client has a cache.
+    # None uses the default ttl of the cache, 0 does not cache this endpoint.
+    cache_ttl = None
+    # (attribute, filter) used by EndpointMirror to fetch only the records changed since the 
+    # last sync, e.g. ('ondate', 'ondate_gte'). The filter must be in allowed_filters (server side).
+    sync_watermark = None
+    # Number of pages fetched concurrently after the first page. 1 fetches the pages one at a time.
+    # Keep this at or below the pool_size of the client.
+    max_page_workers = 1
+    # Number of pages fetched concurrently by the aget_* methods.
+    max_async_page_workers = 10
+    # Multivalue filter on the record id, used by get_many. E.g. equipmentid for Equipment
+    id_filter = None
+    # Number of ids sent in one id_filter request
+    id_filter_chunk_size = 100
+    # Number of concurrent requests made by get_many
+    max_bulk_workers = 4
+    # Longest query string of a request. Longer multivalue filters are split into chunks
+    # that are fetched as separate queries. None uses planner.DEFAULT_MAX_QUERY_LENGTH
+    max_query_length = None
+    # Number of chunked queries fetched concurrently
+    max_chunk_workers = 4
+    # Types of the attributes of this endpoint in addition to ATTR_DATATYPE_MAPPING.
+    # Key is the attribute name and value is the function used to cast it, e.g. {'logdate': parsedate}
+    attribute_types = {}
+    # Set to False to always send get_filtered_list queries, even when the same query 
+    # is already running on the client
+    coalesce_queries = True
+    # Number of queries run concurrently by fan_out
+    max_fanout_workers = 4
+
+    def __init__(self, baseurl=None, tokenfp=None, client=None, pool_size=DEFAULT_POOL_SIZE):
+        '''
+        Either pass in baseurl and tokenfp, or an existing SISClient.
+        When baseurl and tokenfp are used, the pooled client is shared by all the 
+        endpoint instances that use the same baseurl and token.
+        '''
+        if client is None:
+            if baseurl is None or tokenfp is None:
+                raise ValueError('Either baseurl and tokenfp or client is required')
+            client = SISClient.shared(baseurl, read_token(tokenfp), pool_size=pool_size)
 
-    def __init__(self, baseurl, tokenfp):
-        self.baseurl = baseurl
-        with open (tokenfp) as f:
-            content = f.read()
-            token = content.strip()
-
+        self.client = client
+        self.baseurl = client.baseurl
         # Set the token to be used in the request header
-        self.auth_header = {'Authorization': f'Bearer {token}',}
+        self.auth_header = client.auth_header
 
-    def get_filtered_list(self, filterby, pathparam = {}, sortby=[]):
+    def get_filtered_list(self, filterby, pathparam = {}, sortby=[], limit=None):
         ''' 
         Sends a request to a list API endpoint and 
         returns filtered results in a flattened format
         Returns a list of dict objects
+        limit returns at most that many records. Unless the class has a custom_sort, no more 
+        pages are requested once limit records have passed the client side filters.
+        If a page fails after the retries, the exception has the failed page number in 
+        its page attribute and the records of the earlier pages in partial_results.
+        Queries split into chunks (see plan) can not be resumed from a page. Their exception 
+        has no page attribute. chunk_params has the server side params of the failed chunk, 
+        with the page[number] of the failed page.
+        '''
+        return self.run_query(self.plan(filterby, pathparam, sortby), limit)
+
+    def run_query(self, query, limit=None):
+        '''
+        Run a QueryPlan (see plan) and return the list of records, like get_filtered_list.
+        The plan is not changed, so the same plan can be run again or from several threads.
+        Identical queries that are already running on the same client are not sent again,
+        the caller waits for the running query and gets a copy of its records.
+        '''
+        snapshot = self.client.snapshot
+        if snapshot is not None and snapshot.has(self, query.pathparam):
+            return snapshot.query(self, query.filterby, query.pathparam, query.sortby)[:limit]
+
+        query_cache = self.client.query_cache
+        if query_cache is not None:
+            cached = query_cache.get(query.key)
+            if cached is not None:
+                return cached[:limit]
+
+        if not self.coalesce_queries:
+            return self._run_query(query, limit)
+        return self.client.inflight.run((query.key, limit), lambda: self._run_query(query, limit))
+
+    def _run_query(self, query, limit):
+        filtered_data = []
+        try:
+            records = self._iter_plan(query)
+            if limit is not None and not self._has_custom_sort():
+                # the records are in the final order, stop paging once there are enough
+                records = islice(records, limit)
+            filtered_data.extend(records)
+        except Exception as e:
+            # keep the records of the pages fetched before the failed page
+            if hasattr(e, 'page'):
+                e.partial_results = filtered_data
+            raise
+        with timed(self.client.instrumentation, type(self).__name__, 'sort'):
+            sorted_data = self.custom_sort(filtered_data)
+        if limit is not None:
+            # a partial result is not cached
+            return sorted_data[:limit]
+        if self.client.query_cache is not None:
+            self.client.query_cache.set(query.key, sorted_data)
+        return sorted_data
+
+    def first(self, filterby, pathparam = {}, sortby=[]):
+        ''' The first record of get_filtered_list, or None. Stops after the first matching page '''
+        records = self.get_filtered_list(filterby, pathparam, sortby, limit=1)
+        return records[0] if records else None
+
+    def top_k(self, k, key, filterby={}, pathparam = {}):
+        '''
+        The k records with the smallest key, in key order.
+        key is a sort spec like the sortby param, e.g. ['-logdate'] for the latest logs or 'ondate',
+        or a function of the record.
+        When the server can sort on the spec (and the class has no custom_sort), the server sort 
+        is used and paging stops after k records. Otherwise all the records are streamed 
+        through a heap of k records, without sorting or keeping the full result.
+        '''
+        if callable(key):
+            keyfunc = key
+        else:
+            spec = [key] if type(key) == str else list(key)
+            if 'sort' in self.allowed_filters and not self._has_custom_sort():
+                return self.get_filtered_list(filterby, pathparam, sortby=spec, limit=k)
+            keyfunc = sort_key(spec)
+        return heapq.nsmallest(k, self.iter_filtered(filterby, pathparam), key=keyfunc)
+
+    def _has_custom_sort(self):
+        return type(self).custom_sort is not APIBase.custom_sort
+
+    def iter_filtered(self, filterby, pathparam = {}, sortby=[], sort=False):
+        '''
+        Generator version of get_filtered_list. 
+        Yields the flattened, client filtered records as each page arrives, so only 
+        about one page is held in memory at a time. The records are in the server side 
+        sort order (sortby or default_sort).
+        Set sort=True to apply custom_sort. That needs all the records, so they are 
+        collected before the first one is yielded. The same applies to queries with multivalue
+        filters too long for one URL, which are fetched in chunks and merged.
+        '''
+        records = self.iter_query(self.plan(filterby, pathparam, sortby))
+        if sort:
+            yield from self.custom_sort(list(records))
+        else:
+            yield from records
+
+    def iter_query(self, query):
+        ''' Run a QueryPlan (see plan) and yield the records, like iter_filtered '''
+        snapshot = self.client.snapshot
+        if snapshot is not None and snapshot.has(self, query.pathparam):
+            yield from snapshot.iter_query(self, query.filterby, query.pathparam, query.sortby)
+        else:
+            yield from self._iter_plan(query)
+
+    def fan_out(self, filtersets=None, pathparams=None, filterby={}, sortby=[], max_workers=None, sort=False):
+        '''
+        Runs the same query for each filter set (added to filterby) with each path parameter and 
+        yields one merged result, e.g. se.fan_out(filtersets=[{'netcode': n} for n in netcodes]).
+        Up to max_workers (default max_fanout_workers) queries run at a time.
+        The records are in the server side sort order (sortby or default_sort) without the duplicate ids.
+        Set sort=True to apply custom_sort, which collects all the records first.
+        If a query fails, the exception has the QueryPlan of that query in its query attribute.
+        '''
+        plans = [self.plan(filterby | filterset, pathparam, sortby)
+                 for filterset in filtersets or [{}] for pathparam in pathparams or [{}]]
+        records = self._fan_out(plans, max_workers or self.max_fanout_workers)
+        if sort:
+            yield from self.custom_sort(list(records))
+        else:
+            yield from records
+
+    def _fan_out(self, plans, max_workers):
+        ''' Yields the merged records of the plans, see fan_out '''
+        if len(plans) == 1:
+            try:
+                yield from self.iter_query(plans[0])
+            except Exception as e:
+                e.query = plans[0]
+                raise
+            return
+
+        stop = threading.Event()
+
+        def run(plan, results):
+            # hand the records over in batches, then None when done or the exception
+            records = self.iter_query(plan)
+            # about a page at a time, so the merge can start after the first page of each query
+            size = int(plan.params.get('page[size]', FANOUT_BATCH_SIZE))
+            try:
+                while not stop.is_set():
+                    batch = list(islice(records, size))
+                    if not batch:
+                        break
+                    results.put(batch)
+                results.put(None)
+            except BaseException as e:
+                e.query = plan
+                results.put(e)
+            finally:
+                records.close()
+
+        def stream(results):
+            while True:
+                batch = results.get()
+                if batch is None:
+                    return
+                if isinstance(batch, BaseException):
+                    raise batch
+                yield from batch
+
+        executor = ThreadPoolExecutor(max_workers=max(1, max_workers))
+        try:
+            streams = []
+            for plan in plans:
+                results = queue.SimpleQueue()
+                executor.submit(run, plan, results)
+                streams.append(stream(results))
+            yield from merge_results(streams, plans[0].sortby, presorted=True)
+        finally:
+            # stops the running queries after their current batch when the caller stops early
+            stop.set()
+            executor.shutdown(wait=True, cancel_futures=True)
+
+    def get_columns(self, filterby, pathparam = {}, sortby=[], format='dict'):
+        '''
+        Sends a request to a list API endpoint and returns the filtered results in 
+        columnar form instead of a list of dicts. Each page is flattened and 
+        written straight into per-attribute column buffers.
+        format is one of
+            'dict': dict of column name to column. Float columns are array('d')
+            'numpy': dict of column name to numpy array. Float columns are float64 and 
+                     ondate/offdate are datetime64[us] in UTC
+            'pandas': pandas DataFrame built from the numpy columns
+        Rows are in the server side sort order, custom_sort is not applied.
+        '''
+        builder = ColumnBuilder(self.datatypes())
+        builder.extend(self.iter_filtered(filterby, pathparam, sortby))
+        return builder.result(format)
+
+    def get_by_id(self, id, flatten=True):
+        ''' Get the detail page for given id '''
+        res = self._send_request(id=id)
+        if flatten:
+            elem_list = self._flatten_data([res['data']])
+            return self.record_factory()(elem_list[0]) if self.compact_records else elem_list[0]
+        else:
+            return res['data']
+
+    def get_many(self, ids):
+        '''
+        Get the records for many ids. Duplicate ids are fetched once.
+        If the endpoint has an id_filter, the ids are fetched in chunks with that server side
+        multivalue filter. Otherwise the detail pages are fetched concurrently.
+        Up to max_bulk_workers requests are made at a time.
+        Returns a tuple of two dicts keyed by id: the records found and the errors.
+        A failed request only fails the ids it was for.
+        '''
+        ids = list(dict.fromkeys(int(id) for id in ids))
+        results = {}
+        errors = {}
+        if not ids:
+            return results, errors
+
+        if self.id_filter in self.allowed_multivalue_filters:
+            size = self.id_filter_chunk_size
+            chunks = [ids[i:i + size] for i in range(0, len(ids), size)]
+            def fetch(chunk):
+                return list(self.iter_filtered({self.id_filter: [str(id) for id in chunk]}))
+        else:
+            chunks = [[id] for id in ids]
+            def fetch(chunk):
+                return [self.get_by_id(chunk[0])]
+
+        with ThreadPoolExecutor(max_workers=self.max_bulk_workers) as executor:
+            futures = [(chunk, executor.submit(fetch, chunk)) for chunk in chunks]
+            for chunk, future in futures:
+                try:
+                    records = future.result()
+                except Exception as e:
+                    self.logger.warning(f'Unable to get {self.endpointurl} ids {chunk}. Error: {e}')
+                    for id in chunk:
+                        errors[id] = e
+                    continue
+                for rec in records:
+                    results[rec['id']] = rec
+                for id in chunk:
+                    if id not in results:
+                        errors[id] = LookupError(f'{self.endpointurl} id {id} not found')
+
+        return results, errors
+
+    async def aget_filtered_list(self, filterby, pathparam = {}, sortby=[], client=None):
+        '''
+        asyncio version of get_filtered_list. Requires aiohttp.
+        After the first page, the rest of the pages are fetched concurrently on the 
+        running event loop, with at most max_async_page_workers requests in flight.
+        The query is planned like get_filtered_list (see plan): the chunks of a chunked query 
+        are fetched concurrently and merged, and the snapshot and query cache of the client are used.
+        client is an AsyncSISClient. Defaults to the one shared on the running event loop.
+        '''
+        query = self.plan(filterby, pathparam, sortby)
+        snapshot = self.client.snapshot
+        if snapshot is not None and snapshot.has(self, query.pathparam):
+            return snapshot.query(self, query.filterby, query.pathparam, query.sortby)
+        query_cache = self.client.query_cache
+        if query_cache is not None:
+            cached = query_cache.get(query.key)
+            if cached is not None:
+                return cached
+
+        client = client or self._get_async_client()
+        url = f'{self.baseurl}/{query.endpointurl}'
+        label = type(self).__name__
+        # shared by the chunks of the query, so at most max_async_page_workers requests are in flight
+        semaphore = asyncio.Semaphore(self.max_async_page_workers)
+
+        async def fetch_page(params, page):
+            async with semaphore:
+                logger.info (f'Sending a request to {url} with filter: {params} page: {page}')
+                return await client.get(url, params=params | {'page[number]': page}, label=label)
+
+        async def fetch_chunk(params):
+            res = await fetch_page(params, params['page[number]'])
+            number_of_pages = res['meta']['pagination']['pages']
+            pages = range(params['page[number]'] + 1, number_of_pages + 1)
+            # gather returns the responses in page order
+            responses = [res] + list(await asyncio.gather(*[fetch_page(params, page) for page in pages]))
+            return list(self._iter_records(responses, query.client_filters))
+
+        results = await asyncio.gather(*[fetch_chunk(params) for params in query.chunks])
+        filtered_data = results[0] if len(results) == 1 else list(merge_results(results, query.sortby))
+        with timed(client.instrumentation, label, 'sort'):
+            sorted_data = self.custom_sort(filtered_data)
+        if query_cache is not None:
+            query_cache.set(query.key, sorted_data)
+        return sorted_data
+
+    async def aget_by_id(self, id, flatten=True, client=None):
+        ''' asyncio version of get_by_id. Requires aiohttp. '''
+        client = client or self._get_async_client()
+        url = f'{self.baseurl}/{self.endpointurl}/{id}'
+        logger.info (f'Sending a request to {url}')
+        res = await client.get(url, label=type(self).__name__)
+        if flatten:
+            elem_list = self._flatten_data([res['data']])
+            return self.record_factory()(elem_list[0]) if self.compact_records else elem_list[0]
+        else:
+            return res['data']
+
+    def plan(self, filterby, pathparam = {}, sortby=[]):
         '''
+        Returns the QueryPlan (see planner.py) used by get_filtered_list and iter_filtered for 
+        these arguments: the validated endpoint url and server side params, the compiled client 
+        side filters, and the chunks of multivalue filters that are too long for one URL.
+        The plan is immutable. Keep it to run the same query again with fetch or iter, 
+        without validating and compiling the filters each time.
+        '''
+        return plan_query(self, filterby, pathparam, sortby)
+
+    def explain(self, filterby, pathparam = {}, sortby=[]):
+        ''' Describe how get_filtered_list would run the query, without sending it '''
+        return self.plan(filterby, pathparam, sortby).explain()
+
+    def _iter_plan(self, plan):
+        '''
+        Yields the records of a QueryPlan. A plan with one chunk is streamed page by page.
+        The chunks of a chunked plan are fetched concurrently, up to max_chunk_workers at a time,
+        then merged in the sort order without the duplicate ids.
+        '''
+        if len(plan.chunks) == 1:
+            return self._iter_records(self._iter_pages(plan.endpointurl, **plan.chunks[0]), plan.client_filters)
+
+        def fetch(params):
+            try:
+                return list(self._iter_records(self._iter_pages(plan.endpointurl, **params), plan.client_filters))
+            except Exception as e:
+                # the page number is within one chunk, resuming the whole query from it would skip records
+                page = getattr(e, 'page', None)
+                if page is not None:
+                    del e.page
+                    params = params | {'page[number]': page}
+                e.chunk_params = dict(params)
+                raise
+        with ThreadPoolExecutor(max_workers=max(1, plan.max_workers)) as executor:
+            results = list(executor.map(fetch, plan.chunks))
+        return merge_results(results, plan.sortby)
+
+    def _get_async_client(self):
+        return AsyncSISClient.shared(self.client.baseurl, self.client.token, pool_size=self.client.pool_size,
+                                     rate_limiter=self.client.rate_limiter, retry=self.client.retry,
+                                     instrumentation=self.client.instrumentation)
+
+    def _query_key(self, endpointurl, filterparams, client_filters):
+        '''
+        Key for the query cache. Made up of the endpoint class, baseurl, endpointurl 
+        (with the path parameter), the server side params and the client side filters.
+        Multivalue filter values are sorted so the order of the values does not matter.
+        '''
+        params = []
+        for k, v in filterparams.items():
+            if k in self.allowed_multivalue_filters and type(v) == str:
+                v = tuple(sorted(v.split(',')))
+            params.append((k, freeze(v)))
+        return (type(self), self.baseurl, endpointurl, 
+                tuple(sorted(params)), freeze(client_filters.filterkw))
+
+    def _build_params(self, filterby, pathparam = {}, sortby=[]):
+        '''
+        Validates the filters and path parameters.
+        Returns a tuple of endpointurl (including the path parameter if any), 
+        the server side filter params and the compiled client side filters (ClientFilter)
+        '''
+        endpointurl = self.endpointurl
         filterparams = dict(self.default_filters)
         sortby = sortby if sortby else self.default_sort
         if sortby:
             filterparams['sort'] = ','.join(sortby)
         client_filters = {}
         for k, v in filterby.items():
+            if k == OR_KEY and self.allowed_client_filters:
+                # groups of client filters that are ORed
+                client_filters[k] = v
+                continue
             if k in self.allowed_multivalue_filters:
                 if type(v) == list:
                     filterparams[k] = ','.join(v)
@@ -64,7 +496,7 @@ class APIBase(object):
                     filterparams[k] = v
             elif k in self.allowed_filters:
                 filterparams[k] = v
-            elif k in self.allowed_client_filters:
+            elif is_allowed(k, self.allowed_client_filters):
                 client_filters[k] = v
             else:
                 self.logger.warning(f'Filter param "{k}" not supported by endpoint {self.endpointurl}')
@@ -73,175 +505,244 @@ class APIBase(object):
             self.logger.warning(f'Multiple path parameters {pathparam.keys()} specified. Only one is supported. Using the first supported one.')
         for k, v in pathparam.items():
             if k in self.allowed_path_parameters:
-                self.endpointurl = f'{k}/{v}/{self.endpointurl}'
+                endpointurl = f'{k}/{v}/{endpointurl}'
                 break
             else:
                 self.logger.warning(f'Path param "{k}" not supported by endpoint {self.endpointurl}')
 
+        return endpointurl, filterparams, self.compile_filters(client_filters)
 
-        all_data, incl_data = self._get_all_pages(**filterparams)
-
-        if all_data is None:
-            return
-
-        incl_elems = self._flatten_data(incl_data)
-        # convert into lookup dict where key is (type, id)
-        lookup_map = {}
-        for e in incl_elems:
-            t = e.pop('type')
-            id = e.pop('id')
-            lookup_map[(t, id)] = e
-
-        elem_list = self._flatten_data(all_data, lookup_map)
-        filtered_data = [ elem for elem in elem_list if self._filter_data(elem, client_filters) ]
-        sorted_data = self.custom_sort(filtered_data)
-        return sorted_data
-
-    def get_by_id(self, id, flatten=True):
-        ''' Get the detail page for given id '''
-        res = self._send_request(id=id)
-        if flatten:
-            elem_list = self._flatten_data([res['data']])
-            return elem_list[0]
-        else:
-            return res['data']
+    def _iter_records(self, pages, client_filters):
+        '''
+        Takes an iterable of page responses. For each page, flattens the data,
+        merges in the included data of that page and applies the client side filters.
+        Yields the records that pass the filters.
+        client_filters is a ClientFilter or a dict of client filters.
+        '''
+        if not isinstance(client_filters, ClientFilter):
+            client_filters = self.compile_filters(client_filters)
+        inst = self.client.instrumentation
+        label = type(self).__name__
+        for res in pages:
+            with timed(inst, label, 'flatten'):
+                incl_elems = self._flatten_data(res.get('included', None) or [])
+                # convert into lookup dict where key is (type, id)
+                lookup_map = {}
+                for e in incl_elems:
+                    t = e.pop('type')
+                    id = e.pop('id')
+                    lookup_map[(t, id)] = e
+
+                elem_list = self._flatten_data(res['data'], lookup_map)
+            if inst is not None:
+                # filter the page at once so the time spent and the records kept can be counted
+                received = len(elem_list)
+                if client_filters:
+                    with timed(inst, label, 'filter'):
+                        elem_list = [e for e in elem_list if client_filters(e)]
+                inst.page(label)
+                inst.records(label, received, len(elem_list))
+            elif client_filters:
+                elem_list = filter(client_filters, elem_list)
+            if self.compact_records:
+                elem_list = map(self.record_factory(), elem_list)
+            yield from elem_list
+
+    @classmethod
+    def datatypes(cls):
+        ''' ATTR_DATATYPE_MAPPING updated with the attribute_types of this endpoint '''
+        return ssa.ATTR_DATATYPE_MAPPING | cls.attribute_types
+
+    @classmethod
+    def attribute_caster(cls):
+        '''
+        Returns the function that casts the attributes of a resource of this endpoint (see decoding.py).
+        Compiled once per endpoint class, and again if ATTR_DATATYPE_MAPPING is changed.
+        '''
+        datatypes = cls.datatypes()
+        compiled = cls.__dict__.get('_attribute_caster', None)
+        if compiled is None or compiled[0] != datatypes:
+            compiled = (datatypes, compile_caster(datatypes))
+            cls._attribute_caster = compiled
+        return compiled[1]
+
+    @classmethod
+    def record_factory(cls):
+        ''' Returns the RecordFactory shared by all the instances of this endpoint class '''
+        factory = cls.__dict__.get('_record_factory', None)
+        if factory is None:
+            factory = RecordFactory(f'{cls.__name__}Record')
+            cls._record_factory = factory
+        return factory
 
     def custom_sort(self, filtered_data):
         # override in the sub classes to implement a custom sort that is not supported by the SIS API
         return filtered_data
 
-    def _send_request(self, filterkw=None, id=None):
-        url = f'{self.baseurl}/{self.endpointurl}'
+    def _send_request(self, filterkw=None, id=None, endpointurl=None):
+        ''' endpointurl includes the path parameter, if any. Defaults to the endpointurl of the class '''
+        url = f'{self.baseurl}/{endpointurl or self.endpointurl}'
         logger.info (f'Sending a request to {url} with filter: {filterkw} or id: {id}')
         if id:
             url = f'{url}/{id}'
-        r = requests.get(url, headers=self.auth_header, params=filterkw, )
-        r.raise_for_status()
-        res = r.json()
+        res = self.client.get(url, params=filterkw, ttl=self.cache_ttl, label=type(self).__name__)
         return res
 
-    def _get_all_pages (self, **filterkw):
-        ''' 
-        Builds and sends the request and gets all the pages of data.
-        Use filterkw to take advantage of server side filtering and to reduce extra large results.
-        If a huge resultset is expected, add code to handle errors 
-        that might be raised because of server side throttling.
-        '''
-
-        # Initialize a list to store the data entries fetched over multiple requests
-        all_data = []
-        incl_data = []        
-        while (True):
-            res = self._send_request(filterkw=filterkw)
-            all_data.extend(res['data'])
-            incl = res.get('included', None)
-            if incl:
-                incl_data.extend(incl)
+    def _iter_pages(self, endpointurl=None, **filterkw):
+        '''
+        Generator that yields the response for each page, in page order.
+        endpointurl includes the path parameter, if any. Defaults to the endpointurl of the class.
+        The first page is fetched on its own to get the total number of pages.
+        If max_page_workers > 1, the remaining pages are fetched concurrently 
+        with at most max_page_workers requests in flight.
+        Throttled requests are retried by the client. If a page still fails, the exception 
+        raised has a page attribute with the page number, so the query can be resumed 
+        from that page with the page[number] filter.
+        '''
+        res = self._fetch_page(filterkw, filterkw['page[number]'], endpointurl)
+        yield res
 
-            number_of_pages = res['meta']['pagination']['pages']
+        number_of_pages = res['meta']['pagination']['pages']
+        # Use this method to go to the next page, or look under links > next for the url.
+        pages = range(filterkw['page[number]'] + 1, number_of_pages + 1)
+        if not pages:
+            return
 
-            # Go to the next page. Use this method, or look under links > next for the url.
-            filterkw['page[number]'] += 1
-            if filterkw['page[number]'] > number_of_pages:
-                break
-        
-        return all_data, incl_data
+        if self.max_page_workers <= 1 or len(pages) == 1:
+            for page in pages:
+                yield self._fetch_page(filterkw, page, endpointurl)
+            return
+
+        # Keep a window of max_page_workers requests in flight and yield the 
+        # responses in page order, so the server side sort order is retained.
+        with ThreadPoolExecutor(max_workers=self.max_page_workers) as executor:
+            pending = deque()
+            pages = iter(pages)
+            for page in pages:
+                pending.append(executor.submit(self._fetch_page, filterkw, page, endpointurl))
+                if len(pending) >= self.max_page_workers:
+                    break
+            try:
+                while pending:
+                    res = pending.popleft().result()
+                    page = next(pages, None)
+                    if page is not None:
+                        pending.append(executor.submit(self._fetch_page, filterkw, page, endpointurl))
+                    yield res
+            finally:
+                for future in pending:
+                    future.cancel()
+
+    def _fetch_page(self, filterkw, page, endpointurl=None):
+        ''' Fetch one page. Errors get a page attribute with the page number that failed '''
+        try:
+            return self._send_request(filterkw=filterkw | {'page[number]': page}, endpointurl=endpointurl)
+        except Exception as e:
+            e.page = page
+            self.logger.error(f'Unable to get page {page} of {endpointurl or self.endpointurl}. Resume with page[number]={page}. Error: {e}')
+            raise
 
     def _flatten_data(self, data, lookup={}):
         '''
         Takes in the json data element of form: 
             [{type: <type>, id:<id> attributes: { dict of attribs }, relationships: {}, links: {} }
-        Extracts the type, id and everything under attributes, ignores relationships and links.
-        For columns defined in ATTR_DATATYPE_MAPPING, cast the values using the data type
+        Extracts the type, id and everything under attributes, ignores links.
+        Relationships are resolved with _resolve_relationships.
+        For columns defined in ATTR_DATATYPE_MAPPING or attribute_types, cast the values using the data type
         Returns: elem_list: [ { type : <type>, id: int(<id>), attr1: <val1>, attr2: <val2> ..}]
         '''
+        cast_attributes = self.attribute_caster()
+        datatypes = self.datatypes()
         elem_list = []
         for elem in data:
             elem_detail = {'type' : elem['type'], 
                            'id': int(elem['id']) }
+            elem_detail.update(elem['attributes'])
+            cast_attributes(elem_detail)
 
-            for attr, val in elem['attributes'].items():
-                if attr in ssa.ATTR_DATATYPE_MAPPING and val is not None:
-                    # cast the val to the datatype defined in ATTR_DATATYPE_MAPPING
-                    try:
-                        val = ssa.ATTR_DATATYPE_MAPPING[attr](val)
-                    except Exception as e:
-                        logger.warning(f'Unable to cast {attr} value {val} to {ssa.ATTR_DATATYPE_MAPPING[attr]}. Error: {e}')
-                elem_detail[attr] = val
-
-            if lookup:
-                for rel, reldict in elem['relationships'].items():
-                    if 'meta' in reldict or 'data' not in reldict:
-                        # generally present for many to many relations. 
-                        # not supported right now
-                        continue
-
-                    d = reldict['data']
-                    if not d:
-                        continue
-
-                    lookup_key = (d['type'], int(d['id']))
-                    if lookup_key in lookup:
-                        # do not overwrite any keys already present. 
-                        # E.g. ondate is present in many objects, do not overwrite 
-                        # the root object's ondate with the one from the lookup table
-                        for lk, lkval in lookup[lookup_key].items():
-                            if lk not in elem_detail:
-                                elem_detail[lk] = lkval
+            relationships = elem.get('relationships', None)
+            if relationships:
+                self._resolve_relationships(elem_detail, relationships, lookup, datatypes)
 
             elem_list.append(elem_detail)
         return elem_list
 
-    def _filter_data(self, elem, filterkw):
-        ''' 
-        Client side filtering 
-        '''
-        filters = []
-        matched = True
-        # For now all filterkw keys are expected to be in the allowed list, 
-        # but that might not be the case if filters are chained.
-        # Hence repeat the check to see if filter is supported by this class
-        for k, val in filterkw.items():
-            if k in self.allowed_client_filters:
-                filters.append ((k, val))
-
-        # No client filters, return
-        if not filters:
-            return matched
-
-        for k, val in filters:
-            filterkey, filtertype = k, None
-            if '_' in k:
-                filterkey, filtertype = k.split('_')
-
-            elem_val = elem[filterkey]
-            if filterkey == 'offdate' and elem_val is None:
-                elem_val = ssa.FUTURE_OFF_DATE
-
-            if filterkey in ssa.ATTR_DATATYPE_MAPPING and type(val) == str:
-                val = ssa.ATTR_DATATYPE_MAPPING[filterkey](val)
-
-            # Filters are ANDed implicitly. Check for failing condition and break out if match fails
-            if filtertype is None:
-                # cases insensitive search
-                if val.lower() != elem_val.lower():
-                    matched = False
-                    break 
-
-            elif filtertype in ('q', 'icontains'):
-                if val.lower() not in elem_val.lower():
-                    matched = False
-                    break
+    def _resolve_relationships(self, elem_detail, relationships, lookup, datatypes=None):
+        '''
+        Resolves the relationships of one element. lookup is keyed by (type, id) 
+        so each related object is found in constant time.
+        Relationships listed in relationship_fields are projected as defined there, 
+        for both to-one and to-many relationships.
+        In addition, the attributes of a to-one related object found in lookup are 
+        merged into elem_detail without overwriting the keys already present.
+        E.g. ondate is present in many objects, do not overwrite 
+        the root object's ondate with the one from the lookup table
+        datatypes is passed to _related_value.
+        '''
+        for rel, reldict in relationships.items():
+            if 'data' not in reldict:
+                continue
+            d = reldict['data']
+
+            spec = self.relationship_fields.get(rel, None)
+            if spec is not None:
+                name = spec.get('name', rel)
+                attr = spec['attr']
+                if type(d) == list:
+                    vals = [self._related_value(r, attr, lookup, datatypes) for r in d]
+                    join = spec.get('join', None)
+                    elem_detail[name] = join.join(str(v) for v in vals if v is not None) if join is not None else vals
+                else:
+                    elem_detail[name] = self._related_value(d, attr, lookup, datatypes) if d else None
 
-            elif filtertype == 'gte':
-                if val > elem_val:
-                    matched = False
-                    break
+            if 'meta' in reldict or not d or type(d) == list or not lookup:
+                # to-many relations are only resolved when listed in relationship_fields
+                continue
 
-            elif filtertype == 'lte':
-                if val < elem_val:
-                    matched = False
-                    break
-        return matched
+            lookup_key = (d['type'], int(d['id']))
+            if lookup_key in lookup:
+                for lk, lkval in lookup[lookup_key].items():
+                    if lk not in elem_detail:
+                        elem_detail[lk] = lkval
+
+    def _related_value(self, reldata, attr, lookup, datatypes=None):
+        '''
+        Returns the value of attr for a related object. reldata is the resource 
+        identifier from the relationship. The attributes are read from reldata if 
+        embedded, otherwise from the included data in lookup.
+        Embedded values are cast with datatypes (defaults to the datatypes of the class). 
+        Values that fail to cast are kept as is, with a warning.
+        '''
+        if attr == 'id':
+            return int(reldata['id'])
+        if 'attributes' in reldata:
+            val = reldata['attributes'].get(attr, None)
+            datatypes = datatypes if datatypes is not None else self.datatypes()
+            cast = datatypes.get(attr, None)
+            if cast is not None and val is not None:
+                try:
+                    val = cast(val)
+                except Exception as e:
+                    self.logger.warning(f'Unable to cast {attr} value {val} to {cast}. Error: {e}')
+            return val
+        related = lookup.get((reldata['type'], int(reldata['id'])), None)
+        if related is None:
+            return None
+        return related.get(attr, None)
+
+    def compile_filters(self, filterkw):
+        '''
+        Compile the client side filters supported by this endpoint into a ClientFilter.
+        The ClientFilter is a predicate that can be reused across pages and queries.
+        '''
+        return ClientFilter(filterkw, self.allowed_client_filters, self.datatypes())
 
+    def _filter_data(self, elem, filterkw):
+        ''' 
+        Client side filtering. filterkw is a dict of filters or a compiled ClientFilter.
+        When filtering many records, compile the filters once with compile_filters instead.
+        '''
+        if not isinstance(filterkw, ClientFilter):
+            filterkw = self.compile_filters(filterkw)
+        return filterkw(elem)
 
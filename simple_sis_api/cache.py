@@ -0,0 +1,182 @@
+'''
+cache.py
+Create date: 20261017
+Version: 0.1
+
+Persistent HTTP response cache used by SISClient.
+Responses are keyed by the full url and query params. Each entry has an expiry time (ttl).
+Expired entries are revalidated with ETag / Last-Modified when the server sent them.
+'''
+
+import os
+import time
+import sqlite3
+import threading
+import logging
+from abc import ABC, abstractmethod
+from urllib.parse import urlencode
+from .decoding import loads
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_TTL = 3600
+DEFAULT_MAX_BYTES = 512 * 1024 * 1024
+
+class CacheMissError(LookupError):
+    ''' Raised in cache only (offline) mode when a response is not in the cache '''
+
+def cache_key(url, params=None):
+    ''' The full url with the params sorted by name '''
+    if not params:
+        return url
+    items = sorted((k, str(v)) for k, v in params.items())
+    return f'{url}?{urlencode(items)}'
+
+class CacheEntry(object):
+    ''' A cached response '''
+
+    def __init__(self, key, content, etag=None, last_modified=None, expires=0):
+        self.key = key
+        self.content = content
+        self.etag = etag
+        self.last_modified = last_modified
+        self.expires = expires
+
+    @property
+    def expired(self):
+        return self.expires <= time.time()
+
+    def json(self):
+        return loads(self.content)
+
+    def conditional_headers(self):
+        ''' Headers used to revalidate the entry with the server '''
+        headers = {}
+        if self.etag:
+            headers['If-None-Match'] = self.etag
+        if self.last_modified:
+            headers['If-Modified-Since'] = self.last_modified
+        return headers
+
+class CacheBackend(ABC):
+    '''
+    Interface for the response cache backends.
+    Subclass and implement get, set, touch, delete and clear to add a backend.
+    '''
+
+    def __init__(self, default_ttl=DEFAULT_TTL, cache_only=False):
+        # ttl in seconds used when the endpoint does not define cache_ttl
+        self.default_ttl = default_ttl
+        # when True, never send requests. Serve everything from the cache, even if expired.
+        self.cache_only = cache_only
+
+    @abstractmethod
+    def get(self, key):
+        ''' Returns the CacheEntry for key or None '''
+
+    @abstractmethod
+    def set(self, key, content, etag=None, last_modified=None, ttl=None):
+        ''' Store a response. ttl None uses default_ttl '''
+
+    @abstractmethod
+    def touch(self, key, ttl=None):
+        ''' Extend the expiry of an entry that the server said is not modified '''
+
+    @abstractmethod
+    def delete(self, key):
+        ''' Remove the entry for key, if any '''
+
+    @abstractmethod
+    def clear(self):
+        ''' Remove all the entries '''
+
+    def close(self):
+        pass
+
+    def expiry(self, ttl):
+        return time.time() + (self.default_ttl if ttl is None else ttl)
+
+class SQLiteCache(CacheBackend):
+    '''
+    Response cache stored in a SQLite database file.
+    When the total size of the cached responses goes over max_bytes,
+    the least recently used entries are evicted.
+    '''
+
+    def __init__(self, path, max_bytes=DEFAULT_MAX_BYTES, default_ttl=DEFAULT_TTL, cache_only=False):
+        super().__init__(default_ttl=default_ttl, cache_only=cache_only)
+        path = os.path.expanduser(path)
+        self.path = path
+        self.max_bytes = max_bytes
+        dirname = os.path.dirname(os.path.abspath(path))
+        os.makedirs(dirname, exist_ok=True)
+        # The connection is shared by the threads fetching pages concurrently. Guarded by _lock.
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('''CREATE TABLE IF NOT EXISTS responses (
+            key TEXT PRIMARY KEY, content BLOB, etag TEXT, last_modified TEXT,
+            expires REAL, accessed REAL, size INTEGER)''')
+        self._conn.execute('CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed)')
+        self._size = self._conn.execute('SELECT COALESCE(SUM(size), 0) FROM responses').fetchone()[0]
+
+    def get(self, key):
+        with self._lock:
+            row = self._conn.execute('SELECT content, etag, last_modified, expires FROM responses WHERE key = ?',
+                                     (key, )).fetchone()
+            if row is None:
+                return None
+            self._conn.execute('UPDATE responses SET accessed = ? WHERE key = ?', (time.time(), key))
+        return CacheEntry(key, *row)
+
+    def set(self, key, content, etag=None, last_modified=None, ttl=None):
+        size = len(content)
+        if size > self.max_bytes:
+            return
+        now = time.time()
+        with self._lock:
+            old = self._conn.execute('SELECT size FROM responses WHERE key = ?', (key, )).fetchone()
+            self._conn.execute('INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?, ?)',
+                               (key, content, etag, last_modified, self.expiry(ttl), now, size))
+            self._size += size - (old[0] if old else 0)
+            if self._size > self.max_bytes:
+                self._evict()
+
+    def _evict(self):
+        ''' Delete the least recently used entries until the cache is at 90% of max_bytes. Called with _lock held. '''
+        target = self.max_bytes * 0.9
+        rows = self._conn.execute('SELECT key, size FROM responses ORDER BY accessed').fetchall()
+        evict = []
+        for key, size in rows:
+            if self._size <= target:
+                break
+            evict.append((key, ))
+            self._size -= size
+        self._conn.executemany('DELETE FROM responses WHERE key = ?', evict)
+        logger.info(f'Evicted {len(evict)} responses from the cache {self.path}')
+
+    def touch(self, key, ttl=None):
+        with self._lock:
+            self._conn.execute('UPDATE responses SET expires = ?, accessed = ? WHERE key = ?',
+                               (self.expiry(ttl), time.time(), key))
+
+    def delete(self, key):
+        with self._lock:
+            old = self._conn.execute('SELECT size FROM responses WHERE key = ?', (key, )).fetchone()
+            if old:
+                self._conn.execute('DELETE FROM responses WHERE key = ?', (key, ))
+                self._size -= old[0]
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute('DELETE FROM responses')
+            self._size = 0
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    @property
+    def size(self):
+        ''' Total size of the cached responses in bytes '''
+        return self._size
@@ -5,7 +5,7 @@ Create date: 20240402
 Version: 0.1
 '''
 
-from simple_sis_api import APIBase
+from simple_sis_api import APIBase, parsedate
 
 class SiteEpoch(APIBase):
     endpointurl = 'site-epochs'
@@ -17,6 +17,10 @@ class SiteEpoch(APIBase):
         'ondate_gte', 'ondate_lte', 'offdate_gte', 'offdate_lte']
     # Default values if applicable
     default_sort = ['netcode', 'lookupcode']
+    # Add the site id, e.g. to join with Site
+    relationship_fields = {
+        'site': {'attr': 'id', 'name': 'site_id'},
+    }
 
 class EquipmentInstallation(APIBase):
     endpointurl = 'equipment-installations'
@@ -27,6 +31,13 @@ class EquipmentInstallation(APIBase):
     allowed_client_filters = []
     # Default values if applicable
     default_sort = ['categorygroup', 'category', 'modelname', 'serialnumber']
+    # used by EndpointMirror for delta syncs
+    sync_watermark = ('ondate', 'ondate_gte')
+    # Add the equipment and site epoch ids, e.g. to join with Equipment and SiteEpoch
+    relationship_fields = {
+        'equipment': {'attr': 'id', 'name': 'equipment_id'},
+        'siteepoch': {'attr': 'id', 'name': 'siteepoch_id'},
+    }
 
     def custom_sort(self, filtered_data):
         # sort by seismic equipment first and then the rest.
@@ -80,6 +91,9 @@ class SiteLog(APIBase):
     allowed_client_filters = []
     # Default values if applicable
     default_sort = ['logtype', 'logdate']
+    # used by EndpointMirror for delta syncs
+    sync_watermark = ('logdate', 'logdate_gte')
+    attribute_types = {'logdate': parsedate}
 
 class Site(APIBase):
     endpointurl = 'sites'
@@ -89,32 +103,11 @@ class Site(APIBase):
     allowed_client_filters = []
     # Default values if applicable
     default_sort = ['network.netcode', 'lookupcode']
-    
-    def _flatten_data(self, data, lookup={}):
-        '''
-        Overrides _flatten_data in APIBase to add sitelabels to Site details
-        '''
-        elem_list = super()._flatten_data(data, lookup)
-
-        # Add places and sitelabels to any existing Site elements
-        for i in range(len(elem_list)):
-            if not elem_list[i]['type'] == 'Site':
-                continue
-
-            matching_elem_in_data = next((d for d in data if int(d.get('id')) == elem_list[i]['id']), None)
-            if not matching_elem_in_data:
-                continue
-
-            if 'relationships' in matching_elem_in_data.keys():
-                if 'sitelabels' in matching_elem_in_data['relationships']:
-                    elem_list[i]['sitelabels'] = []
-                    for sitelabel in matching_elem_in_data['relationships']['sitelabels']['data']:
-                        elem_list[i]['sitelabels'].append(sitelabel['attributes']['labelname'])
-                    elem_list[i]['sitelabels'] = ', '.join(elem_list[i]['sitelabels'])
-                if 'place' in matching_elem_in_data['relationships']:
-                    elem_list[i]['place_id'] = matching_elem_in_data['relationships']['place']['data']['id']
-
-        return elem_list
+    # Add sitelabels and place_id to Site details
+    relationship_fields = {
+        'sitelabels': {'attr': 'labelname', 'join': ', '},
+        'place': {'attr': 'id', 'name': 'place_id'},
+    }
 
 class Equipment(APIBase):
     endpointurl = 'equipment'
@@ -125,6 +118,8 @@ class Equipment(APIBase):
     allowed_client_filters = []
     # Default values if applicable
     default_sort = ['categorygroup', 'category', 'modelname', 'serialnumber']
+    # used by get_many
+    id_filter = 'equipmentid'
 
 class EquipmentCategory(APIBase):
     endpointurl = 'equipment-categories'
@@ -134,6 +129,8 @@ class EquipmentCategory(APIBase):
     allowed_client_filters = []
     # Default values if applicable
     default_sort = ['categorygroup', 'category', ]
+    # rarely changes, keep cached responses for a day
+    cache_ttl = 24 * 3600
 
 class EquipmentModel(APIBase):
     endpointurl = 'equipment-models'
@@ -143,6 +140,8 @@ class EquipmentModel(APIBase):
     allowed_client_filters = []
     # Default values if applicable
     default_sort = ['modelname', ]
+    # rarely changes, keep cached responses for a day
+    cache_ttl = 24 * 3600
 
 class EquipmentLog(APIBase):
     endpointurl = 'equipment-logs'
@@ -154,6 +153,7 @@ class EquipmentLog(APIBase):
         'subject_q', 'author_q']
     # Default values if applicable
     default_sort = ['logdate', 'subject']
+    attribute_types = {'logdate': parsedate}
 
 class EquipmentProblem(APIBase):
     endpointurl = 'equipment-problems'
@@ -173,6 +173,8 @@ class Network(APIBase):
     allowed_filters = APIBase.allowed_filters + []
     allowed_client_filters = []
     default_sort = []
+    # rarely changes, keep cached responses for a day
+    cache_ttl = 24 * 3600
 
 class Organization(APIBase):
     endpointurl = 'organizations'
@@ -181,6 +183,8 @@ class Organization(APIBase):
     allowed_filters = APIBase.allowed_filters + []
     allowed_client_filters = ['namespace', 'orgcode_q']
     default_sort = ['orgcode']
+    # rarely changes, keep cached responses for a day
+    cache_ttl = 24 * 3600
 
 class Place(APIBase):
     endpointurl = 'places'
@@ -191,6 +195,8 @@ class Place(APIBase):
     allowed_client_filters = []
     # Default values if applicable
     default_sort = ['placename', ]
+    # rarely changes, keep cached responses for a day
+    cache_ttl = 24 * 3600
 
 class TelemetryConnection(APIBase):
     endpointurl = 'telemetry-connections'
@@ -211,6 +217,10 @@ class TelemetryNode(APIBase):
     allowed_client_filters = []
     # Default values if applicable
     default_sort = ['ondate',]
+    # Add the equipment installation id, e.g. to join with EquipmentInstallation
+    relationship_fields = {
+        'installation': {'attr': 'id', 'name': 'installation_id'},
+    }
 
 class FdsnwsChannel(APIBase):
     endpointurl = 'fdsnws/channel'
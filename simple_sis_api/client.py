@@ -0,0 +1,216 @@
+'''
+client.py
+Create date: 20261017
+Version: 0.1
+
+Transport used by the endpoint classes. Owns a pooled keep-alive requests.Session
+so repeated requests to the SIS host reuse the same TCP/TLS connections.
+'''
+
+import time
+import threading
+import logging
+import requests
+from requests.adapters import HTTPAdapter
+from .cache import cache_key, CacheMissError
+from .ratelimit import RetryPolicy
+from .decoding import loads
+from .stats import timed
+from .memo import InflightQueries
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_POOL_SIZE = 10
+
+class SISClient(object):
+    '''
+    Holds one pooled requests.Session for a SIS instance (baseurl) and api token.
+    All the endpoint classes built from the same baseurl and token share a single
+    client (see SISClient.shared), unless a client is passed in explicitly.
+    Use it as a context manager to close the pooled connections when done.
+    Set cache to a CacheBackend (e.g. SQLiteCache) to keep the responses on disk.
+    Set query_cache to a QueryCache to keep get_filtered_list results in memory.
+    Set snapshot to a SnapshotStore to answer get_filtered_list and iter_filtered from the
+    snapshots in the store instead of the SIS API.
+    Set rate_limiter to a RateLimiter to stay under a requests per second budget.
+    retry is the RetryPolicy for throttled (429) and unavailable (502, 503, 504) responses.
+    Set instrumentation to an Instrumentation (e.g. StatsCollector) to record the requests, 
+    retries and the time spent in each stage.
+    Identical get_filtered_list queries that run at the same time on the endpoints sharing 
+    a client are fetched once (see InflightQueries).
+    '''
+
+    logger = logger
+
+    # registry of shared clients. key is (baseurl, token)
+    _shared = {}
+    _shared_lock = threading.Lock()
+
+    def __init__(self, baseurl, token, pool_size=DEFAULT_POOL_SIZE, cache=None, query_cache=None, snapshot=None,
+                 rate_limiter=None, retry=None, instrumentation=None):
+        self.baseurl = baseurl.rstrip('/')
+        self.token = token
+        self.pool_size = pool_size
+        self.cache = cache
+        self.query_cache = query_cache
+        self.snapshot = snapshot
+        self.rate_limiter = rate_limiter
+        self.retry = retry if retry is not None else RetryPolicy()
+        self.instrumentation = instrumentation
+        self.inflight = InflightQueries()
+        self.auth_header = {'Authorization': f'Bearer {token}',}
+        self.closed = False
+
+        self.session = requests.Session()
+        self.session.headers.update(self.auth_header)
+        # pool_maxsize is the number of connections kept alive per host.
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+    @classmethod
+    def from_tokenfile(cls, baseurl, tokenfp, **kw):
+        ''' Read the token from tokenfp and create a new client '''
+        return cls(baseurl, read_token(tokenfp), **kw)
+
+    @classmethod
+    def shared(cls, baseurl, token, pool_size=DEFAULT_POOL_SIZE):
+        '''
+        Returns the client shared by all the endpoints using this baseurl and token.
+        Creates one if it does not exist yet or if the previous one was closed.
+        pool_size is only used when a new client is created.
+        '''
+        key = (baseurl.rstrip('/'), token)
+        with cls._shared_lock:
+            client = cls._shared.get(key)
+            if client is None or client.closed:
+                client = cls(baseurl, token, pool_size=pool_size)
+                cls._shared[key] = client
+            return client
+
+    @classmethod
+    def close_all(cls):
+        ''' Close all the shared clients '''
+        with cls._shared_lock:
+            clients = list(cls._shared.values())
+        for client in clients:
+            client.close()
+
+    def get(self, url, params=None, ttl=None, label='other'):
+        '''
+        Send a GET request over the pooled session.
+        Raises requests.HTTPError for error responses. Returns the decoded json document.
+        If there is a cache, fresh cached responses are returned without a request.
+        Expired ones are revalidated with ETag / Last-Modified when available.
+        ttl is the time in seconds to keep the response in the cache.
+        None uses the default ttl of the cache, 0 skips the cache.
+        In cache only mode no request is sent, not even for ttl 0. CacheMissError is raised 
+        for responses not in the cache.
+        label is the endpoint class name reported to the instrumentation.
+        '''
+        cache = self.cache
+        inst = self.instrumentation
+        if cache is None or (ttl == 0 and not cache.cache_only):
+            r = self._send(url, params, label=label)
+            r.raise_for_status()
+            return self._decode(r.content, label)
+
+        key = cache_key(url, params)
+        entry = cache.get(key)
+        if entry is not None and (cache.cache_only or not entry.expired):
+            if inst is not None:
+                inst.cache(label, 'hit')
+            return self._decode(entry.content, label)
+        if inst is not None:
+            inst.cache(label, 'miss')
+        if cache.cache_only:
+            raise CacheMissError(f'{key} is not in the cache')
+
+        headers = entry.conditional_headers() if entry is not None else None
+        r = self._send(url, params, headers, label=label)
+        if r.status_code == 304 and entry is not None:
+            self.logger.debug(f'Not modified: {key}')
+            if inst is not None:
+                inst.cache(label, 'revalidated')
+            cache.touch(key, ttl)
+            return self._decode(entry.content, label)
+        r.raise_for_status()
+        cache.set(key, r.content, etag=r.headers.get('ETag', None),
+                  last_modified=r.headers.get('Last-Modified', None), ttl=ttl)
+        return self._decode(r.content, label)
+
+    def _decode(self, content, label):
+        with timed(self.instrumentation, label, 'decode'):
+            return loads(content)
+
+    def _send(self, url, params=None, headers=None, label='other'):
+        '''
+        Send the request when the rate limiter allows it. Retry throttled and unavailable 
+        responses and connection errors as per the retry policy. Returns the last response.
+        '''
+        with timed(self.instrumentation, label, 'network'):
+            return self._send_with_retries(url, params, headers, label)
+
+    def _send_with_retries(self, url, params, headers, label):
+        inst = self.instrumentation
+        attempt = 0
+        while True:
+            if self.rate_limiter is not None:
+                self.rate_limiter.acquire()
+            if inst is not None:
+                start = time.perf_counter()
+            try:
+                r = self.session.get(url, params=params, headers=headers)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                if inst is not None:
+                    inst.request(label, url, None, time.perf_counter() - start, 0)
+                if not self.retry.should_retry(attempt):
+                    raise
+                if inst is not None:
+                    inst.retry(label, url, None)
+                delay = self.retry.delay(attempt)
+                self.logger.warning(f'Request to {url} failed: {e}. Retrying in {delay:.1f}s')
+            else:
+                if inst is not None:
+                    inst.request(label, url, r.status_code, time.perf_counter() - start, len(r.content))
+                if not self.retry.should_retry(attempt, r.status_code):
+                    return r
+                if inst is not None:
+                    inst.retry(label, url, r.status_code)
+                retry_after = r.headers.get('Retry-After', None)
+                delay = self.retry.delay(attempt, retry_after)
+                if retry_after is not None and self.rate_limiter is not None:
+                    # the server asked to slow down. Hold the requests of all the threads.
+                    self.rate_limiter.pause(delay)
+                self.logger.warning(f'Request to {url} returned {r.status_code}. Retrying in {delay:.1f}s')
+                r.close()
+            time.sleep(delay)
+            attempt += 1
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        self.session.close()
+        if self.cache is not None:
+            self.cache.close()
+        with self._shared_lock:
+            key = (self.baseurl, self.token)
+            if self._shared.get(key) is self:
+                del self._shared[key]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def __repr__(self):
+        return f'{self.__class__.__name__}({self.baseurl!r}, pool_size={self.pool_size})'
+
+def read_token(tokenfp):
+    ''' Read the api token from the token file '''
+    with open (tokenfp) as f:
+        content = f.read()
+        token = content.strip()
+    return token
@@ -0,0 +1,229 @@
+'''
+columnar.py
+Create date: 20261017
+Version: 0.1
+
+Collects flattened records into per-attribute column buffers.
+Float attributes in ATTR_DATATYPE_MAPPING are stored in typed float arrays and
+date attributes as int64 microseconds, so they can be handed to NumPy or pandas
+as float64 and datetime64 columns without building a list of rows.
+Date columns are converted in batches: each distinct value in a batch is converted once.
+NumPy and pandas are optional. They are only needed for the 'numpy' and 'pandas' formats.
+'''
+
+import datetime as dt
+import math
+from array import array
+import simple_sis_api as ssa
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+try:
+    import pandas as pd
+except ImportError:
+    pd = None
+
+EPOCH = dt.datetime(1970, 1, 1, tzinfo=dt.UTC)
+ONE_MICROSECOND = dt.timedelta(microseconds=1)
+# NumPy uses the smallest int64 as NaT (not a time)
+NAT = -2**63
+
+COLUMN_FORMATS = ('dict', 'numpy', 'pandas')
+
+# Number of date values buffered before they are converted together
+DATE_BATCH_SIZE = 4096
+
+def column_kind(attr, datatypes=None):
+    '''
+    Returns 'int', 'float', 'datetime' or 'object' for the attribute.
+    datatypes defaults to ATTR_DATATYPE_MAPPING
+    '''
+    if attr == 'id':
+        return 'int'
+    datatypes = datatypes if datatypes is not None else ssa.ATTR_DATATYPE_MAPPING
+    cast = datatypes.get(attr, None)
+    if cast is float:
+        return 'float'
+    if cast in ssa.DATE_PARSERS:
+        return 'datetime'
+    return 'object'
+
+def to_float(val):
+    ''' Convert to float. None and values that could not be cast are NaN '''
+    if val is None:
+        return math.nan
+    try:
+        return float(val)
+    except (TypeError, ValueError):
+        return math.nan
+
+def to_epoch_us(val):
+    '''
+    Convert a datetime to microseconds since the epoch. Naive datetimes are taken as UTC.
+    None and values that could not be cast are NaT
+    '''
+    if not isinstance(val, dt.datetime):
+        return NAT
+    if val.tzinfo is None:
+        val = val.replace(tzinfo=dt.UTC)
+    return (val - EPOCH) // ONE_MICROSECOND
+
+def dates_to_epoch_us(values, parse=ssa.parsedate_cached):
+    '''
+    Batch conversion of a column of dates to array('q') of microseconds since the epoch.
+    values can be datetimes, iso strings (parsed with parse) or None (NaT).
+    Each distinct value is converted once, so repeated timestamps cost a dict lookup.
+    '''
+    converted = {}
+    result = array('q')
+    for val in values:
+        us = converted.get(val, None)
+        if us is None:
+            try:
+                us = to_epoch_us(parse(val) if type(val) == str else val)
+            except ValueError:
+                us = NAT
+            converted[val] = us
+        result.append(us)
+    return result
+
+def to_datetime64(values, parse=ssa.parsedate_cached):
+    ''' Convert a column of dates (see dates_to_epoch_us) to a numpy datetime64[us] array in UTC '''
+    if np is None:
+        raise ImportError('numpy is required for datetime64 columns. Install it with: python3 -m pip install numpy')
+    col = dates_to_epoch_us(values, parse)
+    return np.frombuffer(col, dtype=np.int64).view('datetime64[us]') if len(col) else np.empty(0, dtype='datetime64[us]')
+
+class ColumnBuilder(object):
+    '''
+    Appends records into column buffers. Attributes missing from a record are
+    filled with NaN, NaT or None. Columns first seen in a later record are back filled.
+    datatypes (attribute name to cast function) sets the column kinds, see column_kind.
+    Date values can be datetimes or iso strings. They are buffered and converted
+    DATE_BATCH_SIZE at a time.
+    '''
+
+    def __init__(self, datatypes=None):
+        self.datatypes = datatypes
+        self.columns = {}
+        self.kinds = {}
+        # date values not converted yet, per datetime column
+        self.pending = {}
+        self.nrows = 0
+
+    def _new_column(self, attr):
+        kind = column_kind(attr, self.datatypes)
+        self.kinds[attr] = kind
+        if kind == 'float':
+            col = array('d', [math.nan]) * self.nrows
+        elif kind == 'datetime':
+            col = array('q', [NAT]) * self.nrows
+            self.pending[attr] = []
+        elif kind == 'int':
+            col = array('q', [0]) * self.nrows
+        else:
+            col = [None] * self.nrows
+        self.columns[attr] = col
+        return col
+
+    def append(self, record):
+        for attr, val in record.items():
+            col = self.columns.get(attr, None)
+            if col is None:
+                col = self._new_column(attr)
+            kind = self.kinds[attr]
+            if kind == 'float':
+                col.append(val if type(val) is float else to_float(val))
+            elif kind == 'datetime':
+                pending = self.pending[attr]
+                pending.append(val)
+                if len(pending) >= DATE_BATCH_SIZE:
+                    self._flush(attr)
+            elif kind == 'int':
+                col.append(val or 0)
+            else:
+                col.append(val)
+
+        self.nrows += 1
+        # fill the columns not present in this record
+        if len(record) != len(self.columns):
+            for attr, col in self.columns.items():
+                kind = self.kinds[attr]
+                if kind == 'datetime':
+                    pending = self.pending[attr]
+                    if len(col) + len(pending) < self.nrows:
+                        pending.append(None)
+                elif len(col) < self.nrows:
+                    col.append(math.nan if kind == 'float' else 0 if kind == 'int' else None)
+
+    def _flush(self, attr):
+        ''' Convert the buffered values of a datetime column '''
+        pending = self.pending[attr]
+        if pending:
+            self.columns[attr].extend(dates_to_epoch_us(pending))
+            pending.clear()
+
+    def _flush_all(self):
+        for attr in self.pending:
+            self._flush(attr)
+
+    def extend(self, records):
+        for record in records:
+            self.append(record)
+        return self
+
+    def to_dict(self):
+        '''
+        dict of column name to column. Float columns are array('d') with NaN for missing values,
+        id is array('q'), datetime columns are lists of datetime, the rest are lists.
+        '''
+        self._flush_all()
+        result = {}
+        for attr, col in self.columns.items():
+            if self.kinds[attr] == 'datetime':
+                col = [None if v == NAT else EPOCH + v * ONE_MICROSECOND for v in col]
+            result[attr] = col
+        return result
+
+    def to_numpy(self):
+        '''
+        dict of column name to numpy array. Float columns are float64, id is int64,
+        datetime columns are datetime64[us] (UTC), the rest are object arrays.
+        The numeric and datetime arrays share memory with the column buffers, 
+        so do not append to the builder after this.
+        '''
+        if np is None:
+            raise ImportError('numpy is required for the numpy column format. Install it with: python3 -m pip install numpy')
+        self._flush_all()
+        result = {}
+        for attr, col in self.columns.items():
+            kind = self.kinds[attr]
+            if kind == 'float':
+                arr = np.frombuffer(col, dtype=np.float64) if self.nrows else np.empty(0, dtype=np.float64)
+            elif kind == 'datetime':
+                arr = np.frombuffer(col, dtype=np.int64).view('datetime64[us]') if self.nrows else np.empty(0, dtype='datetime64[us]')
+            elif kind == 'int':
+                arr = np.frombuffer(col, dtype=np.int64) if self.nrows else np.empty(0, dtype=np.int64)
+            else:
+                arr = np.empty(len(col), dtype=object)
+                arr[:] = col
+            result[attr] = arr
+        return result
+
+    def to_pandas(self):
+        ''' pandas DataFrame with the numpy columns '''
+        if pd is None:
+            raise ImportError('pandas is required for the pandas column format. Install it with: python3 -m pip install pandas')
+        return pd.DataFrame(self.to_numpy(), copy=False)
+
+    def result(self, format='dict'):
+        if format == 'dict':
+            return self.to_dict()
+        elif format == 'numpy':
+            return self.to_numpy()
+        elif format == 'pandas':
+            return self.to_pandas()
+        raise ValueError(f'Unsupported column format "{format}". Use one of {COLUMN_FORMATS}')
@@ -0,0 +1,59 @@
+'''
+decoding.py
+Create date: 20261017
+Version: 0.1
+
+Fast path for decoding JSON:API pages and typing the attributes.
+The response body is decoded with orjson or msgspec when installed, otherwise with json.
+The attributes are typed by a caster compiled once per endpoint class, which only
+visits the typed attributes of the endpoint instead of checking every attribute.
+'''
+
+import json
+import logging
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgspec
+except ImportError:
+    msgspec = None
+
+logger = logging.getLogger(__name__)
+
+if orjson is not None:
+    JSON_DECODER = 'orjson'
+    _loads = orjson.loads
+elif msgspec is not None:
+    JSON_DECODER = 'msgspec'
+    _loads = msgspec.json.decode
+else:
+    JSON_DECODER = 'json'
+    _loads = json.loads
+
+def loads(content):
+    ''' Decode a JSON document from bytes or str with the fastest decoder installed '''
+    return _loads(content)
+
+def compile_caster(datatypes):
+    '''
+    Returns a function that casts, in place, the attributes of a dict that are in datatypes
+    (attribute name to cast function) and returns the dict.
+    None values are kept. Values that fail to cast are kept as is, with a warning.
+    '''
+    casts = tuple(datatypes.items())
+
+    def cast_attributes(values):
+        for attr, cast in casts:
+            val = values.get(attr, None)
+            if val is None:
+                continue
+            try:
+                values[attr] = cast(val)
+            except Exception as e:
+                logger.warning(f'Unable to cast {attr} value {val} to {cast}. Error: {e}')
+        return values
+    return cast_attributes
@@ -0,0 +1,168 @@
+'''
+filters.py
+Create date: 20261017
+Version: 0.1
+
+Client side filters. The filters for a query are compiled once into a ClientFilter,
+which is then called for every record.
+'''
+
+import operator
+import logging
+import simple_sis_api as ssa
+
+logger = logging.getLogger(__name__)
+
+# filter key used for a list of filter groups that are ORed.
+# E.g. {'or': [{'sitetypes_q': 'strong'}, {'telemetrytypes_q': 'vsat'}]}
+OR_KEY = 'or'
+
+# suffixes supported after the attribute name. E.g. ondate_gte. No suffix is a case insensitive match.
+FILTER_TYPES = ('q', 'icontains', 'gte', 'lte', 'gt', 'lt', 'in', 'isnull')
+
+_COMPARISONS = dict(gte=operator.ge, lte=operator.le, gt=operator.gt, lt=operator.lt)
+
+def split_filter_key(k):
+    '''
+    Split a filter key into the attribute name and filter type.
+    E.g. ondate_gte -> (ondate, gte), netcode -> (netcode, None), place_id -> (place_id, None)
+    '''
+    filterkey, sep, filtertype = k.rpartition('_')
+    if sep and filtertype in FILTER_TYPES:
+        return filterkey, filtertype
+    return k, None
+
+def is_allowed(k, allowed):
+    '''
+    True if the client filter k can be used on an endpoint whose allowed_client_filters is allowed.
+    Any filter type can be used on an attribute with a filter in allowed, 
+    e.g. ondate_gt, ondate_in and ondate_isnull when ondate_gte is allowed.
+    '''
+    if k in allowed:
+        return True
+    attr = split_filter_key(k)[0]
+    return any(split_filter_key(a)[0] == attr for a in allowed)
+
+def cast_filter_value(filterkey, val, datatypes=None):
+    '''
+    Cast string filter values of the attributes in datatypes (attribute name to cast function).
+    datatypes defaults to ATTR_DATATYPE_MAPPING
+    '''
+    datatypes = datatypes if datatypes is not None else ssa.ATTR_DATATYPE_MAPPING
+    if filterkey in datatypes and type(val) == str:
+        return datatypes[filterkey](val)
+    return val
+
+# string values of boolean filters, as accepted by the SIS API (e.g. isactive=yes)
+TRUE_VALUES = ('yes', 'true', '1')
+FALSE_VALUES = ('no', 'false', '0')
+
+def _lower(val):
+    return val.lower() if type(val) == str else val
+
+class ClientFilter(object):
+    '''
+    Compiled client side filters. Filters are ANDed, groups under the 'or' key are ORed.
+    Call with a flattened record to check if it matches.
+    A ClientFilter holds no per query state, so it can be reused across pages and queries.
+
+    Supported filter types (suffix after the attribute name):
+        none: case insensitive match. yes/true/1 and no/false/0 match boolean values
+        q, icontains: case insensitive contains
+        gte, lte, gt, lt: comparisons
+        in: value is one of a list of values (case insensitive for strings)
+        isnull: value is None when true, not None when false
+    Comparisons and matches are False when the record value is None.
+    offdate None is treated as FUTURE_OFF_DATE except for isnull.
+    '''
+
+    def __init__(self, filterkw, allowed=None, datatypes=None):
+        '''
+        filterkw is a dict of filter key and value.
+        allowed is the list of supported filter keys (see is_allowed). Other keys are ignored with a warning.
+        datatypes is used to cast the filter values, see cast_filter_value.
+        '''
+        self.filterkw = filterkw
+        self.conditions = []
+        for k, val in filterkw.items():
+            if k == OR_KEY:
+                groups = [ClientFilter(g, allowed, datatypes) for g in val]
+                groups = [g for g in groups if g]
+                if groups:
+                    self.conditions.append(self._compile_or(groups))
+            elif allowed is not None and not is_allowed(k, allowed):
+                logger.warning(f'Client filter "{k}" not supported. Ignored')
+            else:
+                self.conditions.append(self._compile(k, val, datatypes))
+
+    def __call__(self, elem):
+        # Filters are ANDed implicitly. Check for failing condition and break out if match fails
+        for cond in self.conditions:
+            if not cond(elem):
+                return False
+        return True
+
+    def __bool__(self):
+        return bool(self.conditions)
+
+    def __repr__(self):
+        return f'{self.__class__.__name__}({self.filterkw!r})'
+
+    @staticmethod
+    def _compile_or(groups):
+        def cond(elem):
+            for g in groups:
+                if g(elem):
+                    return True
+            return False
+        return cond
+
+    @staticmethod
+    def _compile(k, val, datatypes=None):
+        ''' Returns a function that takes a record and returns True if it passes the filter '''
+        filterkey, filtertype = split_filter_key(k)
+        future_off = filterkey == 'offdate'
+
+        def get_value(elem):
+            elem_val = elem.get(filterkey, None)
+            if future_off and elem_val is None:
+                elem_val = ssa.FUTURE_OFF_DATE
+            return elem_val
+
+        if filtertype == 'isnull':
+            if type(val) == str:
+                val = val.lower() in TRUE_VALUES
+            isnull = bool(val)
+            return lambda elem: (elem.get(filterkey, None) is None) == isnull
+
+        if filtertype == 'in':
+            values = val if type(val) in (list, tuple, set, frozenset) else str(val).split(',')
+            values = frozenset(_lower(cast_filter_value(filterkey, v, datatypes)) for v in values)
+            return lambda elem: _lower(get_value(elem)) in values
+
+        val = cast_filter_value(filterkey, val, datatypes)
+
+        if filtertype is None:
+            # case insensitive match. Boolean record values match yes/true/1 or no/false/0
+            val = _lower(val)
+            text = str(val).lower()
+            boolval = val if type(val) == bool else True if text in TRUE_VALUES else False if text in FALSE_VALUES else None
+            def match(elem):
+                elem_val = get_value(elem)
+                if type(elem_val) == bool:
+                    return elem_val == boolval
+                return _lower(elem_val) == val
+            return match
+
+        if filtertype in ('q', 'icontains'):
+            val = _lower(str(val))
+            def contains(elem):
+                elem_val = get_value(elem)
+                return elem_val is not None and val in _lower(str(elem_val))
+            return contains
+
+        compare = _COMPARISONS[filtertype]
+        def comparison(elem):
+            elem_val = get_value(elem)
+            return elem_val is not None and compare(elem_val, val)
+        return comparison
@@ -0,0 +1,134 @@
+'''
+intervals.py
+Create date: 20261017
+Version: 0.1
+
+Interval index over the ondate/offdate of flattened records (SiteEpoch,
+EquipmentInstallation etc.) for "active as of date" and date range overlap queries,
+built once from a fetched result set.
+'''
+
+import heapq
+import datetime as dt
+import simple_sis_api as ssa
+
+# Used for records without an ondate
+PAST_ON_DATE = dt.datetime(1, 1, 1, tzinfo=dt.UTC)
+
+def as_datetime(val):
+    ''' Query dates can be datetimes, dates or iso strings. Naive datetimes are taken as UTC. '''
+    if type(val) == str:
+        val = ssa.parsedate(val)
+    elif type(val) == dt.date:
+        val = dt.datetime(val.year, val.month, val.day)
+    if val.tzinfo is None:
+        val = val.replace(tzinfo=dt.UTC)
+    return val
+
+class _Node(object):
+    __slots__ = ('center', 'by_start', 'by_end', 'left', 'right')
+
+class IntervalIndex(object):
+    '''
+    Centered interval tree over [ondate, offdate] of each record. Both ends are inclusive,
+    the same as the ondate_lte / offdate_gte client filters. An open epoch (offdate None)
+    ends at FUTURE_OFF_DATE. A point or range query takes O(log n + k) for k results.
+    '''
+
+    def __init__(self, records, startattr='ondate', endattr='offdate'):
+        self.startattr = startattr
+        self.endattr = endattr
+        intervals = []
+        for rec in records:
+            start = rec.get(startattr, None) or PAST_ON_DATE
+            end = rec.get(endattr, None) or ssa.FUTURE_OFF_DATE
+            intervals.append((start, end, rec))
+        self.intervals = intervals
+        self.root = self._build(intervals)
+
+    @classmethod
+    def from_endpoint(cls, endpoint, filterby={}, pathparam={}, **kw):
+        ''' Fetch the results of endpoint (e.g. SiteEpoch instance) and index them '''
+        return cls(endpoint.iter_filtered(filterby, pathparam), **kw)
+
+    def __len__(self):
+        return len(self.intervals)
+
+    def _build(self, intervals):
+        if not intervals:
+            return None
+        # the median of the endpoints keeps the tree balanced
+        points = sorted([iv[0] for iv in intervals] + [iv[1] for iv in intervals])
+        center = points[len(points) // 2]
+        left, right, here = [], [], []
+        for iv in intervals:
+            if iv[1] < center:
+                left.append(iv)
+            elif iv[0] > center:
+                right.append(iv)
+            else:
+                here.append(iv)
+        node = _Node()
+        node.center = center
+        node.by_start = sorted(here, key=lambda iv: iv[0])
+        node.by_end = sorted(here, key=lambda iv: iv[1], reverse=True)
+        node.left = self._build(left)
+        node.right = self._build(right)
+        return node
+
+    def active_on(self, date):
+        ''' Records whose interval contains date, i.e. ondate <= date <= offdate '''
+        return self.overlapping(date, date)
+
+    def overlapping(self, start, end):
+        ''' Records whose interval overlaps [start, end], both ends inclusive '''
+        start, end = as_datetime(start), as_datetime(end)
+        result = []
+        stack = [self.root]
+        while stack:
+            node = stack.pop()
+            if node is None:
+                continue
+            if end < node.center:
+                # the intervals here all end at or after center, so they overlap if they start by end
+                for iv in node.by_start:
+                    if iv[0] > end:
+                        break
+                    result.append(iv[2])
+                stack.append(node.left)
+            elif start > node.center:
+                # the intervals here all start at or before center, so they overlap if they end by start
+                for iv in node.by_end:
+                    if iv[1] < start:
+                        break
+                    result.append(iv[2])
+                stack.append(node.right)
+            else:
+                # center is in [start, end], every interval here overlaps
+                result.extend(iv[2] for iv in node.by_start)
+                stack.append(node.left)
+                stack.append(node.right)
+        return result
+
+    def active_on_dates(self, dates):
+        '''
+        Batch version of active_on. Returns a dict of date to the list of active records.
+        Sweeps the dates in order over the intervals sorted by start, so the whole batch
+        takes O((n + m) log n) plus the size of the results.
+        '''
+        queries = sorted(((as_datetime(d), d) for d in dates), key=lambda q: q[0])
+        by_start = sorted(range(len(self.intervals)), key=lambda i: self.intervals[i][0])
+        ends = []
+        active = {}
+        pos = 0
+        result = {}
+        for date, key in queries:
+            while pos < len(by_start) and self.intervals[by_start[pos]][0] <= date:
+                i = by_start[pos]
+                active[i] = self.intervals[i][2]
+                heapq.heappush(ends, (self.intervals[i][1], i))
+                pos += 1
+            while ends and ends[0][0] < date:
+                active.pop(heapq.heappop(ends)[1], None)
+            result[key] = list(active.values())
+        return result
@@ -0,0 +1,177 @@
+'''
+join.py
+Create date: 20261017
+Version: 0.1
+
+Joins flattened records from several endpoints locally, instead of querying one
+endpoint per record of another (e.g. EquipmentInstallation once per SiteEpoch).
+Each endpoint is fetched once, in parallel, and joined on hash tables.
+'''
+
+import logging
+from itertools import chain
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from .filters import is_allowed
+
+logger = logging.getLogger(__name__)
+
+def key_func(on):
+    '''
+    Returns a function that gets the join key of a record.
+    on is an attribute name, a tuple of attribute names or a function of the record.
+    String values are compared case insensitive.
+    '''
+    if callable(on):
+        return on
+    attrs = (on, ) if type(on) == str else tuple(on)
+    def key(rec):
+        vals = []
+        for attr in attrs:
+            val = rec.get(attr, None)
+            vals.append(val.lower() if type(val) == str else val)
+        return tuple(vals)
+    return key
+
+def missing_key(k):
+    return k is None or (type(k) == tuple and None in k)
+
+def warn_missing_key(on, count):
+    ''' A key missing from every record is most likely a wrong attribute name, not missing data '''
+    if count:
+        logger.warning(f'Join key {on} is missing from all {count} records. Check the attribute names '
+                       f'(relationship ids are added by relationship_fields)')
+
+def build_hash_table(records, on):
+    ''' dict of join key to the list of records with that key. Records with a None key are skipped '''
+    key = key_func(on)
+    table = defaultdict(list)
+    count = 0
+    for rec in records:
+        count += 1
+        k = key(rec)
+        if missing_key(k):
+            continue
+        table[k].append(rec)
+    if not table:
+        warn_missing_key(on, count)
+    return table
+
+def merge_records(left, right, prefix, skip=()):
+    '''
+    Merge right into a copy of left. Attributes of right that are already in left
+    are added with prefix, e.g. equip_ondate. Attributes in skip are left out.
+    '''
+    row = dict(left.items())
+    for k, v in right.items():
+        if k in skip:
+            continue
+        row[f'{prefix}{k}' if k in row else k] = v
+    return row
+
+def hash_join(left, right, left_on, right_on=None, how='inner', prefix='right_'):
+    '''
+    Generator that joins the records of left (streamed) with the records of right
+    (held in a hash table) where left_on of left matches right_on of right.
+    how is 'inner' or 'left' (keep the left records without a match).
+    Attributes of right already in the left record are prefixed with prefix.
+    right can be a list of records or a hash table from build_hash_table.
+    '''
+    if how not in ('inner', 'left'):
+        raise ValueError(f'Unsupported join "{how}". Use inner or left')
+    right_on = right_on if right_on is not None else left_on
+    table = right if isinstance(right, dict) else build_hash_table(right, right_on)
+    lkey = key_func(left_on)
+    # the key attributes are the same on both sides, no need to repeat them
+    skip = set(right_on if type(right_on) in (tuple, list) else (right_on, )) if not callable(right_on) else set()
+    count = missing = 0
+    for rec in left:
+        k = lkey(rec)
+        count += 1
+        if missing_key(k):
+            missing += 1
+        matches = table.get(k, None)
+        if matches:
+            for other in matches:
+                yield merge_records(rec, other, prefix, skip)
+        elif how == 'left':
+            yield dict(rec.items())
+    if missing == count:
+        warn_missing_key(left_on, count)
+
+class EndpointJoin(object):
+    '''
+    Joins the results of several endpoints, e.g.
+
+        join = EndpointJoin(SiteEpoch(client=client), shared_filters={'netcode': 'CI', 'isactive': 'yes'})
+        join.add(EquipmentInstallation(client=client), on=('netcode', 'lookupcode'), name='equip')
+        for row in join.rows():
+            ...
+
+    shared_filters are passed to every endpoint that supports them (server or client side).
+    The endpoints added with add are fetched in parallel into hash tables, while the first
+    endpoint is streamed page by page and joined as its records arrive.
+    '''
+
+    logger = logger
+
+    def __init__(self, endpoint, filterby={}, pathparam={}, shared_filters={}, max_workers=4):
+        self.endpoint = endpoint
+        self.filterby = dict(filterby)
+        self.pathparam = dict(pathparam)
+        self.shared_filters = dict(shared_filters)
+        self.max_workers = max_workers
+        self.steps = []
+
+    def add(self, endpoint, on, right_on=None, filterby={}, pathparam={}, how='inner', name=None):
+        '''
+        Join endpoint to the rows so far where on (attributes of the rows so far) matches
+        right_on (attributes of the endpoint records, defaults to on).
+        on and right_on can be an attribute name, a tuple of names or a function of the record.
+        Attributes already in the row are added as <name>_<attribute>. name defaults to
+        the endpoint class name in lower case.
+        Returns self, so calls can be chained.
+        '''
+        name = name or type(endpoint).__name__.lower()
+        self.steps.append(dict(endpoint=endpoint, on=on, right_on=right_on if right_on is not None else on,
+                               filterby=dict(filterby), pathparam=dict(pathparam), how=how, name=name))
+        return self
+
+    def _filters(self, endpoint, filterby):
+        ''' The shared filters supported by endpoint, updated with filterby '''
+        supported = set(endpoint.allowed_filters) | set(endpoint.allowed_multivalue_filters)
+        filters = {k: v for k, v in self.shared_filters.items() 
+                   if k in supported or is_allowed(k, endpoint.allowed_client_filters)}
+        filters.update(filterby)
+        return filters
+
+    def _fetch_table(self, step):
+        endpoint = step['endpoint']
+        records = endpoint.iter_filtered(self._filters(endpoint, step['filterby']), step['pathparam'])
+        table = build_hash_table(records, step['right_on'])
+        self.logger.info(f'Fetched {sum(len(v) for v in table.values())} {type(endpoint).__name__} records to join')
+        return table
+
+    def rows(self):
+        ''' Generator of the joined rows, in the order of the first endpoint '''
+        with ThreadPoolExecutor(max_workers=max(1, self.max_workers)) as executor:
+            # prefetch the right hand sides in parallel
+            futures = [executor.submit(self._fetch_table, step) for step in self.steps]
+            rows = self.endpoint.iter_filtered(self._filters(self.endpoint, self.filterby), self.pathparam)
+            for step, future in zip(self.steps, futures):
+                rows = self._join_step(rows, step, future)
+            yield from rows
+
+    @staticmethod
+    def _join_step(rows, step, future):
+        # wait for the hash table only when the first row needs it
+        rows = iter(rows)
+        first = next(rows, None)
+        table = future.result()
+        if first is None:
+            return
+        yield from hash_join(chain([first], rows), table, step['on'], step['right_on'], how=step['how'], 
+                             prefix=f'{step["name"]}_')
+
+    def to_list(self):
+        return list(self.rows())
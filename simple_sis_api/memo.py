@@ -0,0 +1,161 @@
+'''
+memo.py
+Create date: 20261017
+Version: 0.1
+
+In-process cache of get_filtered_list results, shared by the endpoint instances
+that use the same SISClient. Entries are evicted least recently used first to stay
+within a memory budget, and optionally expire after a ttl.
+Identical queries running at the same time are coalesced into one with InflightQueries.
+'''
+
+import sys
+import copy
+import time
+import threading
+import logging
+from collections import OrderedDict
+from concurrent.futures import Future
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MAX_BYTES = 256 * 1024 * 1024
+
+def freeze(val):
+    ''' Convert filter values into a hashable form '''
+    if isinstance(val, dict):
+        return tuple(sorted((k, freeze(v)) for k, v in val.items()))
+    if isinstance(val, (list, tuple, set, frozenset)):
+        return tuple(freeze(v) for v in val)
+    return val
+
+def estimate_size(records, sample=20):
+    '''
+    Approximate memory used by a list of records, in bytes.
+    Measures the first few records and scales up.
+    '''
+    size = sys.getsizeof(records)
+    n = len(records)
+    if not n:
+        return size
+    measured = records[:sample]
+    total = 0
+    for rec in measured:
+        total += sys.getsizeof(rec)
+        for val in rec.values():
+            total += sys.getsizeof(val)
+    return size + total * n // len(measured)
+
+class QueryCache(object):
+    '''
+    LRU cache of query results bounded by an approximate memory budget (max_bytes).
+    ttl is in seconds. None keeps the entries until they are evicted.
+    Results are copied on the way out so callers can modify them.
+    '''
+
+    def __init__(self, max_bytes=DEFAULT_MAX_BYTES, ttl=None):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        # key: (expires, size, records)
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        ''' Returns a copy of the cached records or None '''
+        with self._lock:
+            entry = self._entries.get(key, None)
+            if entry is not None and entry[0] is not None and entry[0] <= time.time():
+                self._remove(key)
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            records = entry[2]
+        return [copy.copy(rec) for rec in records]
+
+    def set(self, key, records):
+        size = estimate_size(records)
+        if size > self.max_bytes:
+            return
+        expires = time.time() + self.ttl if self.ttl is not None else None
+        records = [copy.copy(rec) for rec in records]
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (expires, size, records)
+            self.size += size
+            while self.size > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+
+    def _remove(self, key):
+        entry = self._entries.pop(key)
+        self.size -= entry[1]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.size = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __repr__(self):
+        return f'{self.__class__.__name__}(entries={len(self)}, size={self.size}, max_bytes={self.max_bytes})'
+
+class InflightQueries(object):
+    '''
+    Coalesces identical queries that run at the same time. The first caller of a key runs
+    the query. Callers that arrive while it is running wait for it and get a copy of its
+    records, or the same exception. Nothing is kept once the query is done.
+    '''
+
+    def __init__(self):
+        self.coalesced = 0
+        # key: [Future of the running query, number of waiting callers]
+        self._running = {}
+        self._lock = threading.Lock()
+
+    def run(self, key, func):
+        ''' Returns func(), or a copy of the result of the running query with the same key '''
+        with self._lock:
+            running = self._running.get(key, None)
+            if running is None:
+                # [future, number of waiting callers]
+                running = self._running[key] = [Future(), 0]
+                leader = True
+            else:
+                running[1] += 1
+                self.coalesced += 1
+                leader = False
+
+        future = running[0]
+        if not leader:
+            return [copy.copy(rec) for rec in future.result()]
+        try:
+            records = func()
+        except BaseException as e:
+            self._finish(key)
+            future.set_exception(e)
+            raise
+        if self._finish(key):
+            # the waiting callers copy from their own snapshot, the caller may modify records
+            future.set_result([copy.copy(rec) for rec in records])
+        else:
+            future.set_result(records)
+        return records
+
+    def _finish(self, key):
+        ''' Remove a query that is done. Returns the number of callers waiting for it '''
+        with self._lock:
+            return self._running.pop(key)[1]
+
+    def __len__(self):
+        return len(self._running)
+
+    def __repr__(self):
+        return f'{self.__class__.__name__}(running={len(self)}, coalesced={self.coalesced})'
@@ -0,0 +1,227 @@
+'''
+planner.py
+Create date: 20261017
+Version: 0.1
+
+Query planning for the list endpoints. Before a query is sent:
+- client side filters the server can evaluate are rewritten as server side filters
+  (e.g. netcode_in on an endpoint with a netcode multivalue filter)
+- multivalue filters too long for one URL are split into chunks that are fetched
+  as separate queries and merged back in the sort order.
+The result is an immutable QueryPlan that can be reused and run concurrently.
+'''
+
+import heapq
+from types import MappingProxyType
+from itertools import product
+from urllib.parse import urlencode, quote_plus
+from .filters import OR_KEY, split_filter_key
+from .utils import sort_key
+
+# Longest query string sent in one request. Servers and proxies commonly reject URLs over 8k.
+DEFAULT_MAX_QUERY_LENGTH = 4000
+
+def push_down(endpoint, filterby):
+    '''
+    Rewrite the filters that the endpoint can evaluate on the server.
+        <attr>_in: [values] -> <attr>: [values] when attr is a multivalue filter
+        or: [{attr: v1}, {attr: v2}] -> attr: [v1, v2] when attr is a multivalue filter
+    Returns the rewritten filters and a list of (original, rewritten) filter keys.
+    '''
+    multivalue = endpoint.allowed_multivalue_filters
+    result = {}
+    pushed = []
+    for k, v in filterby.items():
+        if k in multivalue or k in endpoint.allowed_filters:
+            result[k] = v
+            continue
+        if k == OR_KEY:
+            attr, values = _or_attr(v, multivalue), v
+        else:
+            attr, filtertype = split_filter_key(k)
+            attr = attr if filtertype == 'in' and attr in multivalue else None
+            values = v.split(',') if type(v) == str else v
+        if attr is None or attr in filterby:
+            result[k] = v
+            continue
+        result[attr] = [str(group[attr]) for group in values] if k == OR_KEY else [str(val) for val in values]
+        pushed.append((k, attr))
+    return result, pushed
+
+def _or_attr(groups, multivalue):
+    ''' The attribute if every group of an or filter is an exact match on the same multivalue filter '''
+    attrs = set()
+    for group in groups:
+        if len(group) != 1:
+            return None
+        attrs.update(group.keys())
+    if len(attrs) == 1:
+        attr = attrs.pop()
+        if attr in multivalue and not any(type(group[attr]) == list for group in groups):
+            return attr
+    return None
+
+def chunk_values(values, budget):
+    '''
+    Split values into lists whose comma joined, url encoded length is at most budget.
+    Duplicate values are dropped.
+    '''
+    chunks = []
+    chunk = []
+    size = 0
+    for val in dict.fromkeys(values):
+        # each value after the first is preceded by an encoded comma (%2C)
+        cost = len(quote_plus(val)) + (3 if chunk else 0)
+        if chunk and size + cost > budget:
+            chunks.append(chunk)
+            chunk = []
+            size = 0
+            cost = len(quote_plus(val))
+        if cost > budget:
+            raise ValueError(f'Filter value "{val}" does not fit in a query string of {budget} characters')
+        chunk.append(val)
+        size += cost
+    if chunk:
+        chunks.append(chunk)
+    return chunks
+
+def chunk_params(params, multivalue, max_length):
+    '''
+    Split the server side params into several params whose query string is at most max_length,
+    by chunking the longest multivalue filters.
+    Returns the list of params and a dict of the chunked filter to its list of value chunks.
+    '''
+    if len(urlencode(params)) <= max_length:
+        return [params], {}
+
+    lists = {k: v.split(',') for k, v in params.items() if k in multivalue and type(v) == str}
+    fixed = {k: v for k, v in params.items() if k not in lists}
+    # chunk the longest lists until what is left over fits
+    by_length = sorted(lists, key=lambda k: len(quote_plus(params[k])), reverse=True)
+    for count in range(1, len(by_length) + 1):
+        tochunk = by_length[:count]
+        rest = {k: params[k] for k in by_length[count:]} | fixed
+        # the chunked filters share the rest of the query string equally
+        overhead = len(urlencode(rest)) + sum(len(quote_plus(k)) + 2 for k in tochunk)
+        budget = (max_length - overhead) // count
+        longest = max(len(quote_plus(val)) for k in tochunk for val in lists[k])
+        if budget >= longest:
+            break
+    else:
+        raise ValueError(f'The filters {list(params)} do not fit in a query string of {max_length} characters')
+
+    chunked = {k: chunk_values(lists[k], budget) for k in tochunk}
+    chunks = []
+    for combo in product(*chunked.values()):
+        chunks.append(params | {k: ','.join(vals) for k, vals in zip(chunked, combo)})
+    return chunks, chunked
+
+def merge_results(results, sortby=[], presorted=False):
+    '''
+    Merge the records of several queries, dropping the records with an id seen before.
+    With sortby, each result is sorted with utils.sort_key and they are merged in that order.
+    Set presorted=True when the results are already in that order, e.g. streams of records in the 
+    server side sort order. They are then merged lazily, one record of each result at a time.
+    Otherwise the results are concatenated.
+    '''
+    if sortby:
+        key = sort_key(sortby)
+        records = heapq.merge(*[res if presorted else sorted(res, key=key) for res in results], key=key)
+    else:
+        records = (rec for res in results for rec in res)
+    seen = set()
+    for rec in records:
+        id = rec.get('id', None)
+        if id is not None:
+            if id in seen:
+                continue
+            seen.add(id)
+        yield rec
+
+class QueryPlan(object):
+    '''
+    A validated query on a list endpoint. Use APIBase.plan to create one.
+        endpointurl: endpoint url, including the path parameter
+        params: server side params of the query
+        client_filters: compiled client side filters (ClientFilter)
+        chunks: server side params of each request sequence. More than one when a
+                multivalue filter is too long for one URL
+        chunked: dict of the chunked multivalue filters to their value chunks
+        pushed: list of (filter, server side filter) rewritten to run on the server
+        key: hashable key of the query, used by the query cache and to coalesce identical queries
+    A plan is immutable and does not change the endpoint instance, so it can be kept and run 
+    many times, from several threads at once, with fetch or iter.
+    '''
+
+    __slots__ = ('endpoint', 'filterby', 'pathparam', 'endpointurl', 'params', 'client_filters', 
+                 'chunks', 'chunked', 'pushed', 'max_workers', 'key')
+
+    def __init__(self, endpoint, filterby, pathparam, endpointurl, params, client_filters, chunks, chunked, pushed, max_workers):
+        init = super().__setattr__
+        init('endpoint', endpoint)
+        # the arguments of the query, used when the query is answered from a snapshot
+        init('filterby', MappingProxyType(dict(filterby)))
+        init('pathparam', MappingProxyType(dict(pathparam)))
+        init('endpointurl', endpointurl)
+        init('params', MappingProxyType(dict(params)))
+        init('client_filters', client_filters)
+        init('chunks', tuple(MappingProxyType(dict(chunk)) for chunk in chunks))
+        init('chunked', MappingProxyType({k: tuple(tuple(vals) for vals in v) for k, v in chunked.items()}))
+        init('pushed', tuple(pushed))
+        init('max_workers', max_workers)
+        init('key', endpoint._query_key(endpointurl, params, client_filters))
+
+    def __setattr__(self, name, value):
+        raise AttributeError(f'{type(self).__name__} is immutable. Create a new plan with APIBase.plan')
+
+    def __delattr__(self, name):
+        raise AttributeError(f'{type(self).__name__} is immutable. Create a new plan with APIBase.plan')
+
+    def fetch(self, limit=None):
+        ''' Run the query. Returns the list of records, see APIBase.run_query '''
+        return self.endpoint.run_query(self, limit)
+
+    def iter(self):
+        ''' Run the query. Yields the records, see APIBase.iter_query '''
+        return self.endpoint.iter_query(self)
+
+    @property
+    def sortby(self):
+        sort = self.params.get('sort', None)
+        return sort.split(',') if sort else []
+
+    def explain(self):
+        ''' Description of the plan, one step per line '''
+        lines = [f'{type(self.endpoint).__name__} {self.endpointurl}']
+        for k, attr in self.pushed:
+            lines.append(f'  push down: {k} evaluated on the server as {attr}')
+        server = []
+        for k, v in self.params.items():
+            if k in self.chunked:
+                sizes = [len(chunk) for chunk in self.chunked[k]]
+                server.append(f'{k} ({sum(sizes)} values in {len(sizes)} chunks of at most {max(sizes)})')
+            elif k in self.endpoint.allowed_multivalue_filters:
+                server.append(f'{k} ({len(str(v).split(","))} values)')
+            else:
+                server.append(f'{k}={v}')
+        lines.append(f'  server filters: {", ".join(server)}')
+        if self.client_filters:
+            lines.append(f'  client filters: {", ".join(self.client_filters.filterkw)}')
+        if len(self.chunks) > 1:
+            lines.append(f'  requests: {len(self.chunks)} queries, up to {self.max_workers} at a time, '
+                         f'merged on id and sorted by {", ".join(self.sortby) or "query order"}')
+        else:
+            lines.append('  requests: 1 query')
+        return '\n'.join(lines)
+
+    def __repr__(self):
+        return self.explain()
+
+def plan_query(endpoint, filterby, pathparam={}, sortby=[]):
+    ''' Build the QueryPlan of a query on endpoint (an endpoint class instance) '''
+    filterby, pushed = push_down(endpoint, filterby)
+    endpointurl, params, client_filters = endpoint._build_params(filterby, pathparam, sortby)
+    max_length = endpoint.max_query_length or DEFAULT_MAX_QUERY_LENGTH
+    chunks, chunked = chunk_params(params, endpoint.allowed_multivalue_filters, max_length)
+    return QueryPlan(endpoint, filterby, pathparam, endpointurl, params, client_filters, chunks, chunked, pushed,
+                     endpoint.max_chunk_workers)
@@ -0,0 +1,107 @@
+'''
+ratelimit.py
+Create date: 20261017
+Version: 0.1
+
+Request scheduling shared by the endpoint instances of a client:
+a token bucket to stay under a requests per second budget, and a retry policy
+for throttled or unavailable responses (429, 503 ...) that honours Retry-After
+and otherwise backs off exponentially with jitter.
+'''
+
+import time
+import random
+import asyncio
+import threading
+import logging
+import email.utils
+
+logger = logging.getLogger(__name__)
+
+class RateLimiter(object):
+    '''
+    Token bucket. Allows rate requests per second on average, with bursts of up to burst requests.
+    Thread safe. Share one RateLimiter between clients to share the budget.
+    '''
+
+    def __init__(self, rate, burst=None):
+        self.rate = float(rate)
+        self.burst = float(burst if burst is not None else max(1, rate))
+        self._tokens = self.burst
+        self._updated = time.monotonic()
+        # no requests until this time. Set when the server asks us to slow down.
+        self._paused_until = 0
+        self._lock = threading.Lock()
+
+    def _reserve(self):
+        ''' Take a token. Returns the number of seconds to wait before sending the request '''
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            self._tokens -= 1
+            wait = -self._tokens / self.rate if self._tokens < 0 else 0
+            return max(wait, self._paused_until - now)
+
+    def acquire(self):
+        ''' Block until a request can be sent '''
+        wait = self._reserve()
+        if wait > 0:
+            time.sleep(wait)
+
+    async def acquire_async(self):
+        ''' asyncio version of acquire '''
+        wait = self._reserve()
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+    def pause(self, seconds):
+        ''' Hold all requests for seconds, e.g. after a 429 with Retry-After '''
+        with self._lock:
+            self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+
+    def __repr__(self):
+        return f'{self.__class__.__name__}(rate={self.rate}, burst={self.burst})'
+
+def parse_retry_after(value):
+    ''' Retry-After is either a number of seconds or an HTTP date. Returns seconds or None '''
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        when = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(0.0, when.timestamp() - time.time())
+
+class RetryPolicy(object):
+    '''
+    When and how long to wait before retrying a request.
+    Responses with a status in retry_statuses and connection errors are retried up to
+    max_retries times. The wait is the Retry-After of the response if present, otherwise
+    backoff * 2 ** attempt with full jitter, capped at max_backoff seconds.
+    '''
+
+    def __init__(self, max_retries=3, backoff=0.5, max_backoff=60, retry_statuses=(429, 502, 503, 504)):
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.retry_statuses = frozenset(retry_statuses)
+
+    def should_retry(self, attempt, status=None):
+        if attempt >= self.max_retries:
+            return False
+        return status is None or status in self.retry_statuses
+
+    def delay(self, attempt, retry_after=None):
+        ''' Seconds to wait before retry number attempt + 1 '''
+        seconds = parse_retry_after(retry_after)
+        if seconds is not None:
+            return min(seconds, self.max_backoff)
+        return random.uniform(0, min(self.max_backoff, self.backoff * 2 ** attempt))
+
+    def __repr__(self):
+        return f'{self.__class__.__name__}(max_retries={self.max_retries}, backoff={self.backoff})'
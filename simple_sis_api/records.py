@@ -0,0 +1,124 @@
+'''
+records.py
+Create date: 20261017
+Version: 0.1
+
+Compact record objects used instead of a dict per flattened element.
+A record holds its values in a list and shares the field names and positions with
+all the records of the same schema, so the keys are not repeated in every row.
+Records are read only mappings with dict like access, e.g. rec['netcode'], rec.get('offdate').
+'''
+
+import threading
+from collections.abc import Mapping
+
+# Placeholder for the fields of the schema that are not present in a record
+_MISSING = object()
+
+class Record(Mapping):
+    '''
+    Base class for the record classes created by RecordFactory.
+    Subclasses define _fields (tuple of field names) and _index (field name to position).
+    Existing fields can be updated with rec[key] = val. New keys can not be added.
+    '''
+    __slots__ = ('_values', )
+    _fields = ()
+    _index = {}
+
+    def __init__(self, values):
+        self._values = values
+
+    def __getitem__(self, key):
+        try:
+            val = self._values[self._index[key]]
+        except KeyError:
+            raise KeyError(key) from None
+        if val is _MISSING:
+            raise KeyError(key)
+        return val
+
+    def __setitem__(self, key, val):
+        idx = self._index.get(key, None)
+        if idx is None:
+            raise KeyError(f'{key} is not a field of {self.__class__.__name__}')
+        self._values[idx] = val
+
+    def __contains__(self, key):
+        idx = self._index.get(key, None)
+        return idx is not None and self._values[idx] is not _MISSING
+
+    def __iter__(self):
+        for field, val in zip(self._fields, self._values):
+            if val is not _MISSING:
+                yield field
+
+    def __len__(self):
+        return len(self._values) - self._values.count(_MISSING)
+
+    def __eq__(self, other):
+        if isinstance(other, Mapping):
+            return dict(self.items()) == dict(other.items())
+        return NotImplemented
+
+    __hash__ = None
+
+    def __copy__(self):
+        return self.__class__(list(self._values))
+
+    def __reduce__(self):
+        # the record classes are created at runtime, so pickle records as dicts
+        return (dict, (self.to_dict(), ))
+
+    def __repr__(self):
+        return f'{self.__class__.__name__}({self.to_dict()!r})'
+
+    def to_dict(self):
+        return {field: val for field, val in zip(self._fields, self._values) if val is not _MISSING}
+
+class RecordFactory(object):
+    '''
+    Converts flattened elements (dicts) into Record objects.
+    The schema is the union of the keys seen so far. When an element has a key that
+    is not in the schema, the schema is extended and a new record class is created.
+    Records created before keep their class.
+    '''
+
+    def __init__(self, name):
+        self.name = name
+        self.record_class = None
+        self._lock = threading.Lock()
+
+    @property
+    def fields(self):
+        return self.record_class._fields if self.record_class else ()
+
+    def _extend(self, keys):
+        with self._lock:
+            fields = list(self.fields)
+            seen = set(fields)
+            fields.extend(k for k in keys if k not in seen)
+            fields = tuple(fields)
+            if fields != self.fields:
+                attrs = dict(__slots__=(), _fields=fields,
+                             _index={field: i for i, field in enumerate(fields)})
+                self.record_class = type(self.name, (Record, ), attrs)
+            return self.record_class
+
+    def __call__(self, elem):
+        cls = self.record_class
+        keys = tuple(elem)
+        if cls is not None and keys == cls._fields:
+            # same keys in the same order as the schema. The common case.
+            return cls(list(elem.values()))
+
+        index = cls._index if cls is not None else {}
+        for k in keys:
+            if k not in index:
+                cls = self._extend(keys)
+                index = cls._index
+                break
+
+        values = [_MISSING] * len(cls._fields)
+        for k, val in elem.items():
+            values[index[k]] = val
+        return cls(values)
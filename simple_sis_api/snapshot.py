@@ -0,0 +1,216 @@
+'''
+snapshot.py
+Create date: 20261017
+Version: 0.1
+
+Offline snapshot of endpoint results in a local SQLite database, with a query engine
+that evaluates the same filters as the SIS API (allowed_multivalue_filters,
+allowed_filters and sort) and the client side filters (allowed_client_filters).
+'''
+
+import os
+import re
+import time
+import pickle
+import sqlite3
+import threading
+import datetime as dt
+import logging
+from .filters import ClientFilter, split_filter_key, is_allowed, TRUE_VALUES
+from .utils import sort_key
+from .planner import push_down
+
+logger = logging.getLogger(__name__)
+
+# Attributes stored in their own indexed columns. Multivalue filters on these are done in SQLite.
+INDEXED_ATTRS = ('netcode', 'lookupcode', 'category', 'serialnumber')
+
+# Server side params that are not filters
+PAGING_PARAMS = ('page[number]', 'page[size]', 'sort', 'format')
+
+def table_name(endpoint):
+    ''' Table used for an endpoint class or instance '''
+    cls = endpoint if isinstance(endpoint, type) else type(endpoint)
+    return re.sub(r'\W', '_', cls.endpointurl)
+
+def scope_key(pathparam):
+    ''' Results for different path parameters are kept apart '''
+    return repr(sorted((pathparam or {}).items()))
+
+class SnapshotStore(object):
+    '''
+    Local store of flattened endpoint results.
+    Use dump to save the results of an endpoint, then query (or get_filtered_list on an
+    endpoint whose client has this store as its snapshot) to run queries against it.
+    '''
+
+    logger = logger
+
+    def __init__(self, path):
+        path = os.path.expanduser(path) if path != ':memory:' else path
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute('''CREATE TABLE IF NOT EXISTS snapshots (
+            tablename TEXT, scope TEXT, created REAL, count INTEGER, PRIMARY KEY (tablename, scope))''')
+        self._conn.commit()
+
+    def _create_table(self, table):
+        cols = ', '.join(f'{attr} TEXT COLLATE NOCASE' for attr in INDEXED_ATTRS)
+        self._conn.execute(f'''CREATE TABLE IF NOT EXISTS "{table}" (
+            scope TEXT, pos INTEGER, id INTEGER, {cols}, data BLOB, PRIMARY KEY (scope, id))''')
+        for attr in INDEXED_ATTRS:
+            self._conn.execute(f'CREATE INDEX IF NOT EXISTS "{table}_{attr}" ON "{table}" (scope, {attr})')
+
+    def dump(self, endpoint, filterby={}, pathparam={}, records=None):
+        '''
+        Save the results of the query filterby, pathparam on endpoint in the store,
+        replacing the earlier snapshot of the same endpoint and path parameter.
+        The records are always fetched from the SIS API, even if the client of endpoint has this store as its snapshot.
+        Pass records to save already fetched records instead.
+        Use broad filters (or none) so the snapshot can answer narrower queries.
+        Returns the number of records saved.
+        '''
+        if records is None:
+            records = endpoint._iter_plan(endpoint.plan(filterby, pathparam))
+        table = table_name(endpoint)
+        scope = scope_key(pathparam)
+        # the records are written under a staging scope while they are fetched, and replace the 
+        # snapshot at the end. The lock is only held for the writes, queries run in between.
+        staging = f'{scope}#dump{threading.get_ident()}'
+        with self._lock:
+            self._create_table(table)
+            self._conn.execute(f'DELETE FROM "{table}" WHERE scope = ?', (staging, ))
+        count = 0
+        rows = []
+        try:
+            for rec in records:
+                rec = dict(rec.items())
+                rows.append((staging, count, rec['id'], *(self._text(rec.get(attr, None)) for attr in INDEXED_ATTRS),
+                             pickle.dumps(rec, protocol=pickle.HIGHEST_PROTOCOL)))
+                count += 1
+                if len(rows) >= 1000:
+                    self._insert(table, rows)
+                    rows = []
+            self._insert(table, rows)
+        except BaseException:
+            with self._lock:
+                self._conn.execute(f'DELETE FROM "{table}" WHERE scope = ?', (staging, ))
+                self._conn.commit()
+            raise
+        with self._lock:
+            self._conn.execute(f'DELETE FROM "{table}" WHERE scope = ?', (scope, ))
+            self._conn.execute(f'UPDATE "{table}" SET scope = ? WHERE scope = ?', (scope, staging))
+            self._conn.execute('INSERT OR REPLACE INTO snapshots VALUES (?, ?, ?, ?)', (table, scope, time.time(), count))
+            self._conn.commit()
+        self.logger.info(f'Saved {count} {type(endpoint).__name__} records to the snapshot {self.path}')
+        return count
+
+    def _insert(self, table, rows):
+        placeholders = ', '.join('?' * (len(INDEXED_ATTRS) + 4))
+        with self._lock:
+            self._conn.executemany(f'INSERT OR REPLACE INTO "{table}" VALUES ({placeholders})', rows)
+
+    @staticmethod
+    def _text(val):
+        return None if val is None else str(val)
+
+    def has(self, endpoint, pathparam={}):
+        ''' True if there is a snapshot for the endpoint and path parameter '''
+        with self._lock:
+            row = self._conn.execute('SELECT 1 FROM snapshots WHERE tablename = ? AND scope = ?',
+                                     (table_name(endpoint), scope_key(pathparam))).fetchone()
+        return row is not None
+
+    def info(self):
+        ''' List of (tablename, scope, created, count) of the saved snapshots '''
+        with self._lock:
+            return self._conn.execute('SELECT * FROM snapshots ORDER BY tablename, scope').fetchall()
+
+    def query(self, endpoint, filterby, pathparam={}, sortby=[]):
+        '''
+        Run a query against the snapshot of endpoint (an endpoint class instance).
+        Takes the same arguments and returns the same list of dicts as get_filtered_list.
+        '''
+        return endpoint.custom_sort(list(self.iter_query(endpoint, filterby, pathparam, sortby)))
+
+    def iter_query(self, endpoint, filterby, pathparam={}, sortby=[]):
+        '''
+        Generator version of query. The records are in the sort order, custom_sort is not applied.
+        '''
+        if not self.has(endpoint, pathparam):
+            raise LookupError(f'No snapshot of {type(endpoint).__name__} for path parameter {pathparam} in {self.path}')
+
+        table = table_name(endpoint)
+        filterby, pushed = push_down(endpoint, filterby)
+        where = ['scope = ?']
+        args = [scope_key(pathparam)]
+        filters = {}
+        # multivalue filters on record attributes, attribute: values
+        multivalue = {}
+        # filters that match any of a list of values
+        any_filters = []
+        sortby = sortby if sortby else endpoint.default_sort
+        for k, v in filterby.items():
+            if k in endpoint.allowed_multivalue_filters:
+                values = v if type(v) == list else str(v).split(',')
+                if k in INDEXED_ATTRS:
+                    where.append(f'{k} IN ({", ".join("?" * len(values))})')
+                    args.extend(str(val) for val in values)
+                elif k == endpoint.id_filter:
+                    filters['id_in'] = [int(val) for val in values]
+                elif split_filter_key(k)[1] is None:
+                    multivalue[k] = values
+                else:
+                    any_filters.append(ClientFilter({'or': [{k: val} for val in values]}, datatypes=endpoint.datatypes()))
+            elif k in endpoint.allowed_filters:
+                if k == 'sort':
+                    sortby = v.split(',') if type(v) == str else v
+                elif k not in PAGING_PARAMS:
+                    filters[k] = v
+            elif is_allowed(k, endpoint.allowed_client_filters) or k == 'or':
+                filters[k] = v
+            else:
+                self.logger.warning(f'Filter param "{k}" not supported by endpoint {endpoint.endpointurl}')
+
+        sql = f'SELECT data FROM "{table}" WHERE {" AND ".join(where)} ORDER BY pos'
+        with self._lock:
+            rows = self._conn.execute(sql, args).fetchall()
+
+        first = pickle.loads(rows[0][0]) if rows and multivalue else None
+        for k, values in multivalue.items():
+            # multivalue filters that are not record attributes (e.g. a related object's id) 
+            # can not be evaluated on the stored records
+            if first is not None and k not in first:
+                self.logger.warning(f'Filter param "{k}" can not be evaluated on the snapshot of '
+                                    f'{type(endpoint).__name__}. Ignored')
+            else:
+                filters[f'{k}_in'] = values
+
+        isactive = filters.pop('isactive', None)
+        predicate = ClientFilter(filters, datatypes=endpoint.datatypes())
+        records = (pickle.loads(row[0]) for row in rows)
+        if predicate:
+            records = filter(predicate, records)
+        for any_filter in any_filters:
+            records = filter(any_filter, records)
+        if isactive is not None:
+            records = filter(self._isactive_filter(isactive), records)
+        if sortby:
+            records = sorted(records, key=sort_key(sortby))
+        yield from records
+
+    @staticmethod
+    def _isactive_filter(isactive):
+        ''' isactive=yes matches the records without an offdate or with an offdate in the future '''
+        active = str(isactive).lower() in TRUE_VALUES
+        def check(elem):
+            if 'isactive' in elem:
+                return bool(elem['isactive']) == active
+            offdate = elem.get('offdate', None)
+            return (offdate is None or offdate > dt.datetime.now(dt.UTC)) == active
+        return check
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
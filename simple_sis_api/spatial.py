@@ -0,0 +1,135 @@
+'''
+spatial.py
+Create date: 20261017
+Version: 0.1
+
+Grid index over the latitude/longitude of flattened records (SiteEpoch, Place,
+ShakeAlertSuperNetSites etc.) for great-circle radius, nearest neighbour and
+all pairs within a distance queries, without further requests to SIS.
+'''
+
+import math
+from collections import defaultdict
+
+EARTH_RADIUS_KM = 6371.0088
+KM_PER_DEGREE = math.pi * EARTH_RADIUS_KM / 180
+
+def haversine_km(lat1, lon1, lat2, lon2):
+    ''' Great-circle distance in km between two points given in degrees '''
+    lat1, lon1, lat2, lon2 = map(math.radians, (lat1, lon1, lat2, lon2))
+    a = (math.sin((lat2 - lat1) / 2) ** 2
+         + math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2)
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(a)))
+
+class SpatialIndex(object):
+    '''
+    Buckets the records into a grid of cell_deg x cell_deg degree cells.
+    A query only measures the distance to the records in the cells that overlap
+    the search radius. Records without a latitude or longitude are skipped.
+    Pick a cell size close to the typical search radius (0.5 degrees is about 55 km).
+    '''
+
+    def __init__(self, records, cell_deg=0.5, latattr='latitude', lonattr='longitude'):
+        self.cell_deg = cell_deg
+        self.latattr = latattr
+        self.lonattr = lonattr
+        self.nloncells = math.ceil(360 / cell_deg)
+        self.nlatcells = math.ceil(180 / cell_deg)
+        self.cells = defaultdict(list)
+        self.points = []
+        for rec in records:
+            lat = rec.get(latattr, None)
+            lon = rec.get(lonattr, None)
+            if lat is None or lon is None or math.isnan(lat) or math.isnan(lon):
+                continue
+            point = (lat, lon, rec)
+            self.points.append(point)
+            self.cells[self._cell(lat, lon)].append(point)
+
+    @classmethod
+    def from_endpoint(cls, endpoint, filterby={}, pathparam={}, **kw):
+        ''' Fetch the results of endpoint (e.g. SiteEpoch instance) and index them '''
+        return cls(endpoint.iter_filtered(filterby, pathparam), **kw)
+
+    def __len__(self):
+        return len(self.points)
+
+    def _cell(self, lat, lon):
+        latcell = min(int((lat + 90) // self.cell_deg), self.nlatcells - 1)
+        loncell = int(((lon + 180) % 360) // self.cell_deg)
+        return latcell, loncell
+
+    def _cells_within(self, lat, lon, km):
+        ''' Grid cells that overlap a circle of radius km around lat, lon '''
+        dlat = km / KM_PER_DEGREE
+        minlat, maxlat = lat - dlat, lat + dlat
+        latcells = range(max(0, int((minlat + 90) // self.cell_deg)),
+                         min(self.nlatcells - 1, int((maxlat + 90) // self.cell_deg)) + 1)
+
+        # the circle is widest in longitude at its highest latitude
+        maxabslat = max(abs(minlat), abs(maxlat))
+        if maxabslat >= 90:
+            loncells = range(self.nloncells)
+        else:
+            dlon = km / (KM_PER_DEGREE * math.cos(math.radians(maxabslat)))
+            if dlon >= 180:
+                loncells = range(self.nloncells)
+            else:
+                first = int(((lon - dlon + 180) % 360) // self.cell_deg)
+                count = int(2 * dlon // self.cell_deg) + 2
+                loncells = sorted(set((first + i) % self.nloncells for i in range(min(count, self.nloncells))))
+
+        for latcell in latcells:
+            for loncell in loncells:
+                cell = self.cells.get((latcell, loncell), None)
+                if cell:
+                    yield cell
+
+    def radius(self, lat, lon, km):
+        '''
+        Records within km of lat, lon.
+        Returns a list of (distance_km, record) sorted by distance.
+        '''
+        result = []
+        for cell in self._cells_within(lat, lon, km):
+            for plat, plon, rec in cell:
+                d = haversine_km(lat, lon, plat, plon)
+                if d <= km:
+                    result.append((d, rec))
+        result.sort(key=lambda x: x[0])
+        return result
+
+    def nearest(self, lat, lon, k=1, max_km=None):
+        '''
+        k nearest records to lat, lon, optionally limited to max_km.
+        Returns a list of (distance_km, record) sorted by distance.
+        '''
+        limit = max_km if max_km is not None else math.pi * EARTH_RADIUS_KM
+        km = self.cell_deg * KM_PER_DEGREE
+        while True:
+            km = min(km, limit)
+            result = self.radius(lat, lon, km)
+            # every record closer than km has been found, so the first k are the nearest
+            if len(result) >= k or km >= limit:
+                return result[:k]
+            km *= 2
+
+    def near_record(self, rec, km):
+        ''' Records within km of rec, excluding rec itself. List of (distance_km, record) '''
+        return [(d, other) for d, other in self.radius(rec[self.latattr], rec[self.lonattr], km)
+                if other is not rec]
+
+    def pairs_within(self, km):
+        '''
+        Generator of all the pairs of records within km of each other.
+        Yields (distance_km, record1, record2), each pair once.
+        '''
+        position = {id(rec): i for i, (lat, lon, rec) in enumerate(self.points)}
+        for i, (lat, lon, rec) in enumerate(self.points):
+            for cell in self._cells_within(lat, lon, km):
+                for plat, plon, other in cell:
+                    if position[id(other)] <= i:
+                        continue
+                    d = haversine_km(lat, lon, plat, plon)
+                    if d <= km:
+                        yield d, rec, other
@@ -0,0 +1,196 @@
+'''
+stats.py
+Create date: 20261017
+Version: 0.1
+
+Instrumentation of the request and record processing path. Set the instrumentation
+of a client to an Instrumentation (e.g. StatsCollector) to get called for every
+request, retry, page, cache lookup and processing stage, labelled by endpoint class.
+Without one (the default) the only cost is an "is None" check per page and request.
+'''
+
+import threading
+import time
+from collections import defaultdict
+
+# Processing stages timed by the endpoint classes
+STAGES = ('network', 'decode', 'flatten', 'filter', 'sort')
+
+class Instrumentation(object):
+    '''
+    Hooks called by SISClient, AsyncSISClient and the endpoint classes. The methods do nothing,
+    override the ones needed. label is the endpoint class name, or 'other' for requests made
+    on the client directly. The hooks are called from the threads fetching the pages,
+    so they must be thread safe.
+    '''
+
+    def request(self, label, url, status, seconds, nbytes):
+        ''' An HTTP response was received. status is None for connection errors '''
+
+    def retry(self, label, url, status):
+        ''' A request is retried. status is None for connection errors '''
+
+    def cache(self, label, outcome):
+        ''' Response cache lookup. outcome is hit, miss or revalidated '''
+
+    def page(self, label):
+        ''' A page of results was processed '''
+
+    def records(self, label, received, kept):
+        ''' Number of records on a page, before and after the client side filters '''
+
+    def stage(self, label, stage, seconds):
+        ''' Time spent in a processing stage, one of STAGES '''
+
+class timed(object):
+    '''
+    Context manager that reports the time spent in the block as a stage.
+    Does nothing when instrumentation is None.
+    '''
+    __slots__ = ('instrumentation', 'label', 'name', 'start')
+
+    def __init__(self, instrumentation, label, name):
+        self.instrumentation = instrumentation
+        self.label = label
+        self.name = name
+
+    def __enter__(self):
+        if self.instrumentation is not None:
+            self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if self.instrumentation is not None:
+            self.instrumentation.stage(self.label, self.name, time.perf_counter() - self.start)
+
+def _escape(val):
+    return str(val).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+class StatsCollector(Instrumentation):
+    '''
+    Built in Instrumentation that keeps counters and timings per endpoint class.
+    Export them with to_dict or to_prometheus.
+    '''
+
+    def __init__(self, namespace='sis'):
+        self.namespace = namespace
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self._requests = defaultdict(int)        # (label, status) -> count
+            self._request_seconds = defaultdict(float)
+            self._request_max = defaultdict(float)
+            self._bytes = defaultdict(int)
+            self._retries = defaultdict(int)         # (label, status) -> count
+            self._cache = defaultdict(int)           # (label, outcome) -> count
+            self._pages = defaultdict(int)
+            self._records_in = defaultdict(int)
+            self._records_out = defaultdict(int)
+            self._stage_count = defaultdict(int)     # (label, stage) -> count
+            self._stage_seconds = defaultdict(float)
+
+    def request(self, label, url, status, seconds, nbytes):
+        with self._lock:
+            self._requests[(label, status)] += 1
+            self._request_seconds[label] += seconds
+            self._request_max[label] = max(self._request_max[label], seconds)
+            self._bytes[label] += nbytes
+
+    def retry(self, label, url, status):
+        with self._lock:
+            self._retries[(label, status)] += 1
+
+    def cache(self, label, outcome):
+        with self._lock:
+            self._cache[(label, outcome)] += 1
+
+    def page(self, label):
+        with self._lock:
+            self._pages[label] += 1
+
+    def records(self, label, received, kept):
+        with self._lock:
+            self._records_in[label] += received
+            self._records_out[label] += kept
+
+    def stage(self, label, stage, seconds):
+        with self._lock:
+            self._stage_count[(label, stage)] += 1
+            self._stage_seconds[(label, stage)] += seconds
+
+    def to_dict(self):
+        '''
+        dict of endpoint class name to its stats:
+            requests, status (status code to count), request_seconds, request_seconds_max,
+            bytes, retries, cache (outcome to count), pages, records_in, records_out,
+            stages (stage to dict of count and seconds)
+        '''
+        result = {}
+        def entry(label):
+            if label not in result:
+                result[label] = dict(requests=0, status={}, request_seconds=0.0, request_seconds_max=0.0,
+                                     bytes=0, retries=0, cache={}, pages=0, records_in=0, records_out=0, stages={})
+            return result[label]
+
+        with self._lock:
+            for (label, status), count in self._requests.items():
+                e = entry(label)
+                e['requests'] += count
+                e['status'][status] = count
+            for label, seconds in self._request_seconds.items():
+                entry(label)['request_seconds'] = seconds
+                entry(label)['request_seconds_max'] = self._request_max[label]
+            for label, nbytes in self._bytes.items():
+                entry(label)['bytes'] = nbytes
+            for (label, status), count in self._retries.items():
+                entry(label)['retries'] += count
+            for (label, outcome), count in self._cache.items():
+                entry(label)['cache'][outcome] = count
+            for label, count in self._pages.items():
+                entry(label)['pages'] = count
+            for label, count in self._records_in.items():
+                entry(label)['records_in'] = count
+                entry(label)['records_out'] = self._records_out[label]
+            for (label, stage), count in self._stage_count.items():
+                entry(label)['stages'][stage] = dict(count=count, seconds=self._stage_seconds[(label, stage)])
+        return result
+
+    def to_prometheus(self):
+        ''' The stats in the Prometheus text exposition format '''
+        ns = self.namespace
+        metrics = []
+        def metric(name, mtype, help, samples):
+            metrics.append(f'# HELP {ns}_{name} {help}')
+            metrics.append(f'# TYPE {ns}_{name} {mtype}')
+            for labels, value in samples:
+                labeltext = ','.join(f'{k}="{_escape(v)}"' for k, v in labels)
+                metrics.append(f'{ns}_{name}{{{labeltext}}} {value}')
+
+        with self._lock:
+            metric('requests_total', 'counter', 'HTTP responses by status',
+                   [((('endpoint', label), ('status', status if status is not None else 'error')), count)
+                    for (label, status), count in sorted(self._requests.items(), key=str)])
+            metric('request_seconds_sum', 'counter', 'Total time waiting for responses',
+                   [((('endpoint', label), ), seconds) for label, seconds in sorted(self._request_seconds.items())])
+            metric('request_seconds_max', 'gauge', 'Longest time waiting for a response',
+                   [((('endpoint', label), ), seconds) for label, seconds in sorted(self._request_max.items())])
+            metric('response_bytes_total', 'counter', 'Response body bytes received',
+                   [((('endpoint', label), ), nbytes) for label, nbytes in sorted(self._bytes.items())])
+            metric('retries_total', 'counter', 'Requests retried by status',
+                   [((('endpoint', label), ('status', status if status is not None else 'error')), count)
+                    for (label, status), count in sorted(self._retries.items(), key=str)])
+            metric('cache_total', 'counter', 'Response cache lookups by outcome',
+                   [((('endpoint', label), ('outcome', outcome)), count) for (label, outcome), count in sorted(self._cache.items())])
+            metric('pages_total', 'counter', 'Pages of results processed',
+                   [((('endpoint', label), ), count) for label, count in sorted(self._pages.items())])
+            metric('records_in_total', 'counter', 'Records received, before the client side filters',
+                   [((('endpoint', label), ), count) for label, count in sorted(self._records_in.items())])
+            metric('records_out_total', 'counter', 'Records kept by the client side filters',
+                   [((('endpoint', label), ), count) for label, count in sorted(self._records_out.items())])
+            metric('stage_seconds_sum', 'counter', 'Time spent in each processing stage',
+                   [((('endpoint', label), ('stage', stage)), seconds) for (label, stage), seconds in sorted(self._stage_seconds.items())])
+            metric('stage_seconds_count', 'counter', 'Number of times each processing stage ran',
+                   [((('endpoint', label), ('stage', stage)), count) for (label, stage), count in sorted(self._stage_count.items())])
+        return '\n'.join(metrics) + '\n'
@@ -0,0 +1,189 @@
+'''
+sync.py
+Create date: 20261017
+Version: 0.1
+
+Keeps a local mirror of an endpoint and, after the first run, only fetches what changed.
+The mirror is keyed on the integer id of the flattened records and is saved to a pickle file.
+'''
+
+import os
+import time
+import pickle
+import logging
+import requests
+
+logger = logging.getLogger(__name__)
+
+class EndpointMirror(object):
+    '''
+    Local mirror of the records returned by an endpoint for filterby and pathparam.
+
+    A full refresh fetches everything, upserts the records and deletes the ids that are gone.
+    A delta sync uses the sync_watermark of the endpoint class, e.g. ('ondate', 'ondate_gte'):
+    it fetches the records whose watermark attribute is on or after the latest one in the
+    mirror, using the server side filter. If the endpoint has the isactive server filter,
+    the active records are fetched too. Records the mirror has as active that are no longer
+    active are fetched again by id, so closed epochs and installations get their offdate.
+    Every delta sync therefore downloads all the active records again. For 
+    EquipmentInstallation that is most of the data, so the saving is mostly in the 
+    records that were closed before the last sync.
+    If filterby sets isactive, the active records are not fetched again and closed
+    records are only updated by a full refresh.
+    Ids that return 404 are deleted.
+    Deletions of other records are only detected by a full refresh.
+
+    A full refresh is done when there is no mirror yet, the endpoint has no server side
+    watermark filter, the filters changed, or the last full refresh is older than
+    full_refresh_every seconds.
+    '''
+
+    logger = logger
+
+    def __init__(self, endpoint, path, filterby=None, pathparam=None, full_refresh_every=None):
+        '''
+        endpoint is an instance of an endpoint class, e.g. EquipmentInstallation(baseurl, tokenfp)
+        path is the file used to save the mirror
+        '''
+        self.endpoint = endpoint
+        self.path = os.path.expanduser(path)
+        self.filterby = dict(filterby or {})
+        self.pathparam = dict(pathparam or {})
+        self.full_refresh_every = full_refresh_every
+        self.records = {}
+        self.watermark = None
+        self.last_full = None
+        self.last_sync = None
+        self._load()
+
+    @property
+    def scope(self):
+        ''' Identifies what is mirrored. A change in scope forces a full refresh '''
+        return (type(self.endpoint).__name__, self.endpoint.baseurl,
+                repr(sorted(self.filterby.items())), repr(sorted(self.pathparam.items())))
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, 'rb') as f:
+            state = pickle.load(f)
+        if state.get('scope') != self.scope:
+            self.logger.warning(f'Mirror {self.path} was saved for a different query. It will be fully refreshed.')
+            return
+        self.records = state['records']
+        self.watermark = state['watermark']
+        self.last_full = state['last_full']
+        self.last_sync = state['last_sync']
+
+    def save(self):
+        ''' Save the mirror. Written to a temporary file first so a failed write keeps the old mirror '''
+        state = dict(scope=self.scope, records=self.records, watermark=self.watermark,
+                     last_full=self.last_full, last_sync=self.last_sync)
+        dirname = os.path.dirname(os.path.abspath(self.path))
+        os.makedirs(dirname, exist_ok=True)
+        tmppath = f'{self.path}.tmp'
+        with open(tmppath, 'wb') as f:
+            pickle.dump(state, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmppath, self.path)
+
+    def needs_full_refresh(self):
+        watermark = self.endpoint.sync_watermark
+        if not self.records or self.last_full is None or self.watermark is None:
+            return True
+        if watermark is None or watermark[1] not in self.endpoint.allowed_filters:
+            # no server side filter to fetch only the changes
+            return True
+        if self.full_refresh_every is not None and time.time() - self.last_full > self.full_refresh_every:
+            return True
+        return False
+
+    def sync(self, full=False):
+        '''
+        Bring the mirror up to date and save it.
+        Set full=True to force a full refresh. Returns a dict of sync statistics.
+        '''
+        start = time.time()
+        full = full or self.needs_full_refresh()
+        stats = dict(mode='full' if full else 'delta', fetched=0, added=0, updated=0,
+                     unchanged=0, deleted=0, refetched=0)
+
+        if full:
+            seen = self._upsert(self.endpoint.iter_filtered(self.filterby, self.pathparam), stats)
+            for id in [id for id in self.records if id not in seen]:
+                del self.records[id]
+                stats['deleted'] += 1
+            self.last_full = start
+        else:
+            attr, watermark_filter = self.endpoint.sync_watermark
+            watermark = self.watermark.isoformat() if hasattr(self.watermark, 'isoformat') else self.watermark
+            delta_filters = self.filterby | {watermark_filter: watermark}
+            seen = self._upsert(self.endpoint.iter_filtered(delta_filters, self.pathparam), stats)
+            # a mirror whose filterby sets isactive has no active records to fetch again,
+            # isactive=yes would override its own filter
+            if 'isactive' in self.endpoint.allowed_filters and 'isactive' not in self.filterby:
+                active = self._upsert(self.endpoint.iter_filtered(self.filterby | {'isactive': 'yes'}, self.pathparam), stats)
+                seen |= active
+                # records that were active in the mirror but are not any more
+                closed = [id for id, rec in self.records.items()
+                          if id not in seen and rec.get('offdate', None) is None]
+                self._refetch(closed, stats)
+
+        self._update_watermark()
+        self.last_sync = start
+        self.save()
+        stats['total'] = len(self.records)
+        stats['watermark'] = self.watermark
+        stats['duration'] = time.time() - start
+        self.logger.info(f'Synced {type(self.endpoint).__name__} mirror {self.path}: {stats}')
+        return stats
+
+    def _upsert(self, records, stats):
+        ''' Add or update the records. Returns the set of ids seen '''
+        seen = set()
+        for rec in records:
+            stats['fetched'] += 1
+            id = rec['id']
+            seen.add(id)
+            old = self.records.get(id, None)
+            if old is None:
+                stats['added'] += 1
+            elif old == rec:
+                stats['unchanged'] += 1
+                continue
+            else:
+                stats['updated'] += 1
+            self.records[id] = rec
+        return seen
+
+    def _refetch(self, ids, stats):
+        for id in ids:
+            try:
+                rec = self.endpoint.get_by_id(id)
+            except requests.HTTPError as e:
+                if e.response is not None and e.response.status_code == 404:
+                    del self.records[id]
+                    stats['deleted'] += 1
+                    continue
+                raise
+            stats['refetched'] += 1
+            # the detail page has no included data, so only update the keys it has
+            old = self.records[id]
+            merged = dict(old.items())
+            merged.update(rec.items())
+            if merged != old:
+                self.records[id] = merged
+                stats['updated'] += 1
+
+    def _update_watermark(self):
+        watermark = self.endpoint.sync_watermark
+        if watermark is None:
+            return
+        attr = watermark[0]
+        values = [rec[attr] for rec in self.records.values() if rec.get(attr, None) is not None]
+        self.watermark = max(values) if values else None
+
+    def __len__(self):
+        return len(self.records)
+
+    def __iter__(self):
+        return iter(self.records.values())
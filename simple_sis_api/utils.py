@@ -5,23 +5,79 @@ Create date: 20240402
 Version: 0.1
 '''
 import datetime as dt
+import functools
 
 def parsedate(val):
     if not val:
         return val
     return dt.datetime.fromisoformat(val)
 
+# Number of distinct date strings kept by parsedate_cached
+DATE_CACHE_SIZE = 65536
+
+@functools.lru_cache(maxsize=DATE_CACHE_SIZE)
+def parsedate_cached(val):
+    '''
+    parsedate with a bounded memo of the most recently parsed strings.
+    Use it for attributes where the same timestamps repeat across many records.
+    datetimes are immutable, so the records can share the parsed values.
+    '''
+    return parsedate(val)
+
+# Cast functions that parse dates. Used to recognise the date attributes, e.g. for
+# datetime64 columns. Add custom date parsers used in ATTR_DATATYPE_MAPPING here.
+DATE_PARSERS = {parsedate, parsedate_cached}
+
 FUTURE_OFF_DATE = dt.datetime(3000, 1, 1, tzinfo=dt.UTC)
 
 # define the non string attribute types 
 # key is attribute name and the value is the function used to cast it to the expected datatype
+# For dates, pick the strategy per attribute: parsedate parses every value, 
+# parsedate_cached reuses the values parsed recently.
 ATTR_DATATYPE_MAPPING = dict(latitude=float,
     longitude=float, 
     elevation=float,
     xcoord=float,
     ycoord=float,
     zcoord=float,
-    ondate=parsedate,
-    offdate=parsedate,
+    ondate=parsedate_cached,
+    offdate=parsedate_cached,
 )
 
+
+class _Descending(object):
+    ''' Wraps a value so it sorts in reverse order '''
+    __slots__ = ('val', )
+
+    def __init__(self, val):
+        self.val = val
+
+    def __lt__(self, other):
+        return other.val < self.val
+
+    def __eq__(self, other):
+        return self.val == other.val
+
+def sort_key(sortby):
+    '''
+    Returns a key function that sorts flattened records the way the SIS API sorts on 
+    the sort param, e.g. ['netcode', '-ondate'].
+    A leading - sorts descending. For dotted names like network.netcode the last part is used,
+    since the related attributes are merged into the flattened record.
+    None values sort after the rest. Strings are compared case insensitive.
+    '''
+    fields = []
+    for name in sortby:
+        desc = name.startswith('-')
+        fields.append((name.lstrip('-').split('.')[-1], desc))
+
+    def key(elem):
+        vals = []
+        for attr, desc in fields:
+            val = elem.get(attr, None)
+            if type(val) == str:
+                val = val.lower()
+            val = (val is None, val) if val is not None else (True, 0)
+            vals.append(_Descending(val) if desc else val)
+        return tuple(vals)
+    return key
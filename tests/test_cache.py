@@ -0,0 +1,98 @@
+'''
+Tests of the response cache and cache only mode against the mock SIS server in
+benchmarks/mock_server.py. Run with: python3 -m pytest tests
+'''
+
+import os
+import sys
+import time
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'benchmarks'))
+
+from mock_server import MockSISServer
+from simple_sis_api import SISClient, SiteEpoch, SQLiteCache, CacheMissError
+
+class UncachedSiteEpoch(SiteEpoch):
+    cache_ttl = 0
+
+class CacheTests(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.server = MockSISServer(size=300, page_size=100).start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.stop()
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmpdir.name, 'cache.sqlite')
+        self.clients = []
+
+    def tearDown(self):
+        for client in self.clients:
+            client.close()
+        self.tmpdir.cleanup()
+
+    def client(self, **kw):
+        client = SISClient(self.server.baseurl, 'token', cache=SQLiteCache(self.path, **kw))
+        self.clients.append(client)
+        return client
+
+    def count_requests(self, func):
+        start = self.server.requests
+        result = func()
+        return result, self.server.requests - start
+
+    def test_repeated_query_is_served_from_the_cache(self):
+        se = SiteEpoch(client=self.client())
+        expected, requests = self.count_requests(lambda: se.get_filtered_list({'netcode': 'CI'}))
+        self.assertGreater(requests, 0)
+        records, requests = self.count_requests(lambda: se.get_filtered_list({'netcode': 'CI'}))
+        self.assertEqual(requests, 0)
+        self.assertEqual(records, expected)
+
+    def test_cache_only_mode(self):
+        expected = SiteEpoch(client=self.client()).get_filtered_list({'netcode': 'CI'})
+        se = SiteEpoch(client=self.client(cache_only=True))
+        records, requests = self.count_requests(lambda: se.get_filtered_list({'netcode': 'CI'}))
+        self.assertEqual(requests, 0)
+        self.assertEqual(records, expected)
+        start = self.server.requests
+        with self.assertRaises(CacheMissError):
+            se.get_filtered_list({'netcode': 'BK'})
+        self.assertEqual(self.server.requests, start)
+
+    def test_endpoint_with_ttl_zero_is_not_cached(self):
+        se = UncachedSiteEpoch(client=self.client())
+        se.get_filtered_list({'netcode': 'CI'})
+        _, requests = self.count_requests(lambda: se.get_filtered_list({'netcode': 'CI'}))
+        self.assertGreater(requests, 0)
+        # cache only mode never sends a request, not even for ttl 0
+        se = UncachedSiteEpoch(client=self.client(cache_only=True))
+        start = self.server.requests
+        with self.assertRaises(CacheMissError):
+            se.get_filtered_list({'netcode': 'CI'})
+        self.assertEqual(self.server.requests, start)
+
+    def test_least_recently_used_entries_are_evicted(self):
+        cache = SQLiteCache(self.path, max_bytes=1000)
+        try:
+            cache.set('a', b'x' * 400)
+            time.sleep(0.01)
+            cache.set('b', b'x' * 400)
+            time.sleep(0.01)
+            cache.get('a')
+            time.sleep(0.01)
+            cache.set('c', b'x' * 400)
+            self.assertIsNotNone(cache.get('a'))
+            self.assertIsNone(cache.get('b'))
+            self.assertIsNotNone(cache.get('c'))
+        finally:
+            cache.close()
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,99 @@
+'''
+Tests of ClientFilter against the semantics of the original per record _filter_data,
+on the site epochs of the mock SIS server in benchmarks/mock_server.py.
+Run with: python3 -m pytest tests
+'''
+
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'benchmarks'))
+
+import simple_sis_api as ssa
+from mock_server import MockSISServer
+from simple_sis_api import SISClient, SiteEpoch, ClientFilter
+
+def legacy_filter(elem, filterkw, allowed):
+    ''' The client side filtering of the original APIBase._filter_data '''
+    for k, val in filterkw.items():
+        if k not in allowed:
+            continue
+        filterkey, filtertype = k, None
+        if '_' in k:
+            filterkey, filtertype = k.split('_')
+        elem_val = elem[filterkey]
+        if filterkey == 'offdate' and elem_val is None:
+            elem_val = ssa.FUTURE_OFF_DATE
+        if filterkey in ssa.ATTR_DATATYPE_MAPPING and type(val) == str:
+            val = ssa.ATTR_DATATYPE_MAPPING[filterkey](val)
+        if filtertype is None:
+            if val.lower() != elem_val.lower():
+                return False
+        elif filtertype in ('q', 'icontains'):
+            if val.lower() not in elem_val.lower():
+                return False
+        elif filtertype == 'gte':
+            if val > elem_val:
+                return False
+        elif filtertype == 'lte':
+            if val < elem_val:
+                return False
+    return True
+
+class ClientFilterTests(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.server = MockSISServer(size=600, page_size=200).start()
+        with SISClient(cls.server.baseurl, 'token') as client:
+            cls.se = SiteEpoch(client=client)
+            cls.records = cls.se.get_filtered_list({})
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.stop()
+
+    def assertSameAsLegacy(self, filterkw, records=None):
+        records = records if records is not None else self.records
+        allowed = self.se.allowed_client_filters
+        predicate = self.se.compile_filters(filterkw)
+        expected = [r['id'] for r in records if legacy_filter(r, filterkw, allowed)]
+        self.assertEqual([r['id'] for r in records if predicate(r)], expected, filterkw)
+        self.assertEqual([r['id'] for r in records if self.se._filter_data(r, filterkw)], expected, filterkw)
+        return expected
+
+    def test_same_results_as_legacy_filters(self):
+        for filterkw in ({'sitetypes_q': 'motion'},
+                         {'sitetypes_q': 'SEISMIC'},
+                         {'ondate_gte': '2000-01-01T00:00:00+00:00'},
+                         {'ondate_lte': '2005-06-01T00:00:00+00:00', 'offdate_gte': '2010-01-01T00:00:00+00:00'},
+                         {'offdate_lte': '2015-01-01T00:00:00+00:00'},
+                         {'sitetypes_q': 'seismic', 'ondate_gte': '1995-01-01T00:00:00+00:00', 'offdate_gte': '2026-01-01T00:00:00+00:00'},
+                         # not a client filter of SiteEpoch, ignored by both
+                         {'sitename_q': 'nothing'}):
+            self.assertSameAsLegacy(filterkw)
+
+    def test_open_epochs_pass_offdate_gte(self):
+        expected = self.assertSameAsLegacy({'offdate_gte': '2029-12-31T00:00:00+00:00'})
+        open_epochs = [r['id'] for r in self.records if r['offdate'] is None]
+        self.assertTrue(set(open_epochs) <= set(expected))
+
+    def test_none_values_do_not_match(self):
+        # the legacy filter raised on None values, the ClientFilter does not match them
+        with_value = [r for r in self.records if r['telemetrytypes'] is not None]
+        self.assertLess(len(with_value), len(self.records))
+        expected = self.assertSameAsLegacy({'telemetrytypes_q': 'vsat'}, with_value)
+        predicate = self.se.compile_filters({'telemetrytypes_q': 'vsat'})
+        self.assertEqual([r['id'] for r in self.records if predicate(r)], expected)
+
+    def test_exact_match_is_case_insensitive(self):
+        lookupcode = next(r['lookupcode'] for r in self.records if r['netcode'] == 'CI')
+        filterkw = {'netcode': 'ci', 'lookupcode': lookupcode.lower()}
+        predicate = ClientFilter(filterkw)
+        expected = [r['id'] for r in self.records if legacy_filter(r, filterkw, list(filterkw))]
+        self.assertGreater(len(expected), 0)
+        self.assertEqual([r['id'] for r in self.records if predicate(r)], expected)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,84 @@
+'''
+Tests of IntervalIndex and SpatialIndex against a scan of the site epochs of the mock
+SIS server in benchmarks/mock_server.py. Run with: python3 -m pytest tests
+'''
+
+import os
+import sys
+import unittest
+import datetime as dt
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'benchmarks'))
+
+import simple_sis_api as ssa
+from mock_server import MockSISServer
+from simple_sis_api import SISClient, SiteEpoch, IntervalIndex, SpatialIndex, haversine_km
+from simple_sis_api.intervals import as_datetime
+
+def ids(records):
+    return sorted(r['id'] for r in records)
+
+class IndexTests(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        with MockSISServer(size=900, page_size=300) as server:
+            with SISClient(server.baseurl, 'token') as client:
+                cls.records = SiteEpoch(client=client).get_filtered_list({})
+
+    def active_on(self, date):
+        return [r for r in self.records if r['ondate'] <= date <= (r['offdate'] or ssa.FUTURE_OFF_DATE)]
+
+    def test_active_on(self):
+        index = IntervalIndex(self.records)
+        self.assertEqual(len(index), len(self.records))
+        for rec in self.records[:20]:
+            # both ends are inclusive
+            for date in (rec['ondate'], rec['offdate'] or ssa.FUTURE_OFF_DATE):
+                self.assertEqual(ids(index.active_on(date)), ids(self.active_on(date)))
+                self.assertIn(rec['id'], ids(index.active_on(date)))
+
+    def test_active_on_dates_with_mixed_inputs(self):
+        index = IntervalIndex(self.records)
+        dates = ['2001-03-04T00:00:00+00:00', dt.date(2010, 6, 1), dt.datetime(1995, 1, 1),
+                 dt.datetime(2020, 2, 2, 12, tzinfo=dt.UTC), '1980-01-01T00:00:00+00:00']
+        result = index.active_on_dates(dates)
+        self.assertEqual(set(result), set(dates))
+        for date in dates:
+            expected = ids(self.active_on(as_datetime(date)))
+            self.assertEqual(ids(result[date]), expected)
+            self.assertEqual(ids(index.active_on(date)), expected)
+        self.assertEqual(result['1980-01-01T00:00:00+00:00'], [])
+
+    def test_overlapping(self):
+        index = IntervalIndex(self.records)
+        start, end = dt.datetime(2005, 1, 1, tzinfo=dt.UTC), dt.datetime(2006, 1, 1, tzinfo=dt.UTC)
+        expected = [r for r in self.records if r['ondate'] <= end and (r['offdate'] or ssa.FUTURE_OFF_DATE) >= start]
+        self.assertEqual(ids(index.overlapping(start, end)), ids(expected))
+
+    def test_radius_and_nearest(self):
+        index = SpatialIndex(self.records)
+        lat, lon = 37.0, -119.0
+        distances = sorted((haversine_km(lat, lon, r['latitude'], r['longitude']), r['id']) for r in self.records)
+        for km in (10, 100, 400):
+            self.assertEqual(ids(rec for d, rec in index.radius(lat, lon, km)), sorted(id for d, id in distances if d <= km))
+        self.assertEqual([rec['id'] for d, rec in index.nearest(lat, lon, k=5)], [id for d, id in distances[:5]])
+        self.assertEqual(index.nearest(lat, lon, k=5, max_km=0.001), [])
+
+    def test_pairs_within(self):
+        records = self.records[:200]
+        index = SpatialIndex(records, cell_deg=0.25)
+        expected = sorted(tuple(sorted((a['id'], b['id']))) for i, a in enumerate(records) for b in records[i + 1:]
+                          if haversine_km(a['latitude'], a['longitude'], b['latitude'], b['longitude']) <= 50)
+        self.assertGreater(len(expected), 0)
+        self.assertEqual(sorted(tuple(sorted((a['id'], b['id']))) for d, a, b in index.pairs_within(50)), expected)
+
+    def test_radius_across_the_antimeridian(self):
+        records = [dict(id=1, latitude=51.0, longitude=179.9), dict(id=2, latitude=51.0, longitude=-179.9),
+                   dict(id=3, latitude=51.0, longitude=170.0), dict(id=4, latitude=None, longitude=None)]
+        index = SpatialIndex(records)
+        self.assertEqual(len(index), 3)
+        self.assertEqual(ids(rec for d, rec in index.radius(51.0, 179.95, 20)), [1, 2])
+
+if __name__ == '__main__':
+    unittest.main()
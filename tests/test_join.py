@@ -0,0 +1,57 @@
+'''
+Tests of EndpointJoin on relationship ids against the mock SIS server in benchmarks/mock_server.py.
+Run with: python3 -m pytest tests
+'''
+
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'benchmarks'))
+
+from mock_server import MockSISServer
+from simple_sis_api import SISClient, SiteEpoch, EquipmentInstallation, EndpointJoin, hash_join
+
+class JoinTests(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.server = MockSISServer(size=300, page_size=100).start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.stop()
+
+    def setUp(self):
+        self.client = SISClient(self.server.baseurl, 'token')
+
+    def tearDown(self):
+        self.client.close()
+
+    def test_join_on_relationship_ids(self):
+        join = EndpointJoin(SiteEpoch(client=self.client), shared_filters={'netcode': 'CI'})
+        join.add(EquipmentInstallation(client=self.client), on='id', right_on='siteepoch_id', name='equip')
+        rows = join.to_list()
+
+        siteepoch = {int(rec['id']): int(rec['relationships']['siteepoch']['data']['id'])
+                     for rec in self.server.data['equipment-installations'] if rec['attributes']['netcode'] == 'CI'}
+        self.assertEqual(len(rows), len(siteepoch))
+        self.assertEqual(sorted(row['equip_id'] for row in rows), sorted(siteepoch))
+        for row in rows:
+            self.assertEqual(row['id'], siteepoch[row['equip_id']])
+            self.assertEqual(row['equipment_id'], row['equip_id'])
+
+    def test_missing_join_key_warns(self):
+        left = [dict(id=1), dict(id=2)]
+        right = [dict(id=3, siteepoch_id=1)]
+        with self.assertLogs('simple_sis_api.join', 'WARNING') as cm:
+            self.assertEqual(list(hash_join(left, right, 'id', 'site_epoch_id')), [])
+        self.assertIn('site_epoch_id', cm.output[0])
+        with self.assertLogs('simple_sis_api.join', 'WARNING') as cm:
+            self.assertEqual(list(hash_join(left, right, 'siteepoch', 'siteepoch_id')), [])
+        self.assertIn('siteepoch', cm.output[0])
+        with self.assertNoLogs('simple_sis_api.join', 'WARNING'):
+            self.assertEqual(len(list(hash_join(left, right, 'id', 'siteepoch_id'))), 1)
+
+if __name__ == '__main__':
+    unittest.main()
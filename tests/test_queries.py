@@ -0,0 +1,150 @@
+'''
+Tests of query coalescing, chunked plans and fan_out against the mock SIS server
+in benchmarks/mock_server.py. Run with: python3 -m pytest tests
+'''
+
+import os
+import sys
+import time
+import threading
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'benchmarks'))
+
+from mock_server import MockSISServer
+from simple_sis_api import SISClient, SiteEpoch, EquipmentInstallation, RetryPolicy, sort_key
+from simple_sis_api.memo import InflightQueries
+
+NETCODES = ['CI', 'BK', 'NC', 'UW']
+
+class CoalescedSiteEpoch(SiteEpoch):
+    ''' Holds the running query until the other callers have joined it, so the test does not depend on timing '''
+    waiters = 0
+
+    def _run_query(self, query, limit):
+        deadline = time.time() + 5
+        while self.client.inflight.coalesced < self.waiters and time.time() < deadline:
+            time.sleep(0.001)
+        return super()._run_query(query, limit)
+
+class QueryTests(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.server = MockSISServer(size=2000, page_size=100).start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.stop()
+
+    def setUp(self):
+        self.client = SISClient(self.server.baseurl, 'token')
+
+    def tearDown(self):
+        self.client.close()
+
+    def count_requests(self, func):
+        start = self.server.requests
+        result = func()
+        return result, self.server.requests - start
+
+    def test_concurrent_plan_is_fetched_once(self):
+        nthreads = 8
+        se = CoalescedSiteEpoch(client=self.client)
+        se.waiters = nthreads - 1
+        plan = se.plan({'page[size]': 100, 'netcode': NETCODES})
+        expected, pages = self.count_requests(lambda: SiteEpoch(client=self.client).get_filtered_list(
+            {'page[size]': 100, 'netcode': NETCODES}))
+
+        with ThreadPoolExecutor(max_workers=nthreads) as executor:
+            results, requests = self.count_requests(lambda: list(executor.map(lambda _: plan.fetch(), range(nthreads))))
+        self.assertEqual(requests, pages)
+        self.assertEqual(self.client.inflight.coalesced, nthreads - 1)
+        for records in results:
+            self.assertEqual(records, expected)
+        # each caller gets its own records
+        results[0][0]['netcode'] = 'XX'
+        self.assertNotEqual(results[1][0]['netcode'], 'XX')
+
+    def test_inflight_errors_reach_every_caller(self):
+        inflight = InflightQueries()
+        started = threading.Event()
+        def fail():
+            started.set()
+            while inflight.coalesced < 1:
+                time.sleep(0.001)
+            raise ValueError('failed')
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            leader = executor.submit(inflight.run, 'key', fail)
+            started.wait()
+            follower = executor.submit(inflight.run, 'key', lambda: [])
+            self.assertRaises(ValueError, leader.result)
+            self.assertRaises(ValueError, follower.result)
+        self.assertEqual(len(inflight), 0)
+
+    def test_chunked_plan_matches_unchunked(self):
+        serialnumbers = [f'SN{i:07d}' for i in range(0, 4000, 3)]
+        ei = EquipmentInstallation(client=self.client)
+        expected = ei.get_filtered_list({'serialnumber': serialnumbers})
+
+        chunked = EquipmentInstallation(client=self.client)
+        chunked.max_query_length = 400
+        plan = chunked.plan({'serialnumber': serialnumbers})
+        self.assertGreater(len(plan.chunks), 1)
+        self.assertEqual([r['id'] for r in plan.fetch()], [r['id'] for r in expected])
+        self.assertEqual([r['id'] for r in plan.iter()], [r['id'] for r in ei.iter_filtered({'serialnumber': serialnumbers})])
+
+    def test_failed_chunk_is_resumed_from_its_params(self):
+        serialnumbers = [f'SN{i:07d}' for i in range(0, 4000, 3)]
+        expected = EquipmentInstallation(client=self.client).get_filtered_list({'serialnumber': serialnumbers, 'page[size]': 20})
+        with MockSISServer(size=2000, page_size=100, throttle_every=4) as server:
+            with SISClient(server.baseurl, 'token', retry=RetryPolicy(max_retries=0)) as client:
+                ei = EquipmentInstallation(client=client)
+                ei.max_query_length = 400
+                ei.max_chunk_workers = 1
+                plan = ei.plan({'serialnumber': serialnumbers, 'page[size]': 20})
+                self.assertGreater(len(plan.chunks), 1)
+                with self.assertRaises(Exception) as cm:
+                    plan.fetch()
+                e = cm.exception
+                # the page of a chunk can not resume the whole query
+                self.assertFalse(hasattr(e, 'page'))
+                self.assertFalse(hasattr(e, 'partial_results'))
+                self.assertIn(e.chunk_params, [chunk | {'page[number]': e.chunk_params['page[number]']} for chunk in plan.chunks])
+                server.throttle_every = 0
+                resumed = ei.get_filtered_list(e.chunk_params)
+        serials = set(e.chunk_params['serialnumber'].split(','))
+        chunk = [r for r in expected if r['serialnumber'] in serials]
+        self.assertEqual([r['id'] for r in resumed], [r['id'] for r in chunk[(e.chunk_params['page[number]'] - 1) * 20:]])
+
+    def test_fan_out_merges_in_order_without_duplicates(self):
+        se = SiteEpoch(client=self.client)
+        expected = se.get_filtered_list({'page[size]': 100, 'netcode': NETCODES})
+        # the filter sets overlap on BK and NC
+        records = list(se.fan_out(filtersets=[{'netcode': ['CI', 'BK']}, {'netcode': ['BK', 'NC']}, {'netcode': ['NC', 'UW']}],
+                                  filterby={'page[size]': 100}, max_workers=2))
+        ids = [r['id'] for r in records]
+        self.assertEqual(len(ids), len(set(ids)))
+        self.assertEqual(ids, [r['id'] for r in expected])
+        key = sort_key(se.default_sort)
+        self.assertTrue(all(key(a) <= key(b) for a, b in zip(records, records[1:])))
+
+    def test_fan_out_stops_when_the_caller_breaks(self):
+        se = SiteEpoch(client=self.client)
+        filtersets = [{'netcode': netcode} for netcode in NETCODES]
+        fan_out = lambda: se.fan_out(filtersets=filtersets, filterby={'page[size]': 10}, max_workers=len(filtersets))
+        _, total = self.count_requests(lambda: list(fan_out()))
+
+        start = self.server.requests
+        for i, rec in enumerate(fan_out()):
+            if i == 5:
+                break
+        # closing the generator waits for the running query to stop
+        stopped = self.server.requests
+        time.sleep(0.2)
+        self.assertEqual(self.server.requests, stopped)
+        self.assertLess(stopped - start, total // 2)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,89 @@
+'''
+Tests of SnapshotStore against the mock SIS server in benchmarks/mock_server.py.
+Run with: python3 -m pytest tests
+'''
+
+import os
+import sys
+import threading
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'benchmarks'))
+
+from mock_server import MockSISServer
+from simple_sis_api import SISClient, SnapshotStore, SiteEpoch
+from simple_sis_api.classes import ShakeAlertSuperNetSites
+
+class SnapshotTests(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.server = MockSISServer(size=600, page_size=100).start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.stop()
+
+    def setUp(self):
+        self.store = SnapshotStore(':memory:')
+        self.client = SISClient(self.server.baseurl, 'token', snapshot=self.store)
+        self.se = SiteEpoch(client=self.client)
+        self.stuck = False
+
+    def tearDown(self):
+        self.client.close()
+        if not self.stuck:
+            self.store.close()
+
+    def dump(self, *args):
+        # run in a daemon thread so a deadlock fails the test instead of hanging it
+        result = []
+        thread = threading.Thread(target=lambda: result.append(self.store.dump(self.se, *args)), daemon=True)
+        thread.start()
+        thread.join(timeout=30)
+        self.stuck = thread.is_alive()
+        self.assertFalse(self.stuck, 'dump did not finish')
+        return result[0]
+
+    def count_ci(self):
+        return sum(1 for rec in self.server.data['site-epochs'] if rec['attributes']['netcode'] == 'CI')
+
+    def test_dump_through_a_client_with_the_store(self):
+        self.assertEqual(self.dump(), 600)
+        self.assertTrue(self.store.has(self.se))
+        # a refresh fetches from the server, not from the snapshot it replaces
+        start = self.server.requests
+        self.assertEqual(self.dump({'netcode': 'CI'}), self.count_ci())
+        self.assertGreater(self.server.requests, start)
+        self.assertEqual(len(self.se.get_filtered_list({})), self.count_ci())
+
+    def test_queries_are_answered_from_the_snapshot(self):
+        self.dump()
+        self.client.snapshot = None
+        expected = self.se.get_filtered_list({'netcode': ['CI', 'BK'], 'sitetypes_q': 'seismic'})
+        self.client.snapshot = self.store
+        start = self.server.requests
+        records = self.se.get_filtered_list({'netcode': ['CI', 'BK'], 'sitetypes_q': 'seismic'})
+        self.assertEqual(self.server.requests, start)
+        self.assertEqual([r['id'] for r in records], [r['id'] for r in expected])
+
+    def test_dump_does_not_change_running_queries(self):
+        self.dump()
+        records = self.se.iter_filtered({})
+        first = next(records)
+        self.assertEqual(self.dump({'netcode': 'CI'}), self.count_ci())
+        self.assertEqual(len([first] + list(records)), 600)
+        self.assertEqual(len(self.se.get_filtered_list({})), self.count_ci())
+
+    def test_boolean_server_filters(self):
+        sa = ShakeAlertSuperNetSites(client=self.client)
+        self.store.dump(sa, records=[dict(type='SupernetSite', id=1, lookupcode='A', iscore=True, iseew=False),
+                                     dict(type='SupernetSite', id=2, lookupcode='B', iscore=False, iseew=True)])
+        for value in ('true', 'True', 'yes', '1', True):
+            self.assertEqual([r['id'] for r in self.store.query(sa, {'iscore': value})], [1])
+        for value in ('false', 'no', '0', False):
+            self.assertEqual([r['id'] for r in self.store.query(sa, {'iscore': value})], [2])
+        self.assertEqual([r['id'] for r in sa.get_filtered_list({'iseew': 'yes'})], [2])
+
+if __name__ == '__main__':
+    unittest.main()
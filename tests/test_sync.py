@@ -0,0 +1,87 @@
+'''
+Tests of EndpointMirror against the mock SIS server in benchmarks/mock_server.py.
+Run with: python3 -m pytest tests
+'''
+
+import os
+import sys
+import tempfile
+import unittest
+import datetime as dt
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'benchmarks'))
+
+from mock_server import MockSISServer
+from simple_sis_api import SISClient, EquipmentInstallation, EndpointMirror
+
+ENDPOINT = 'equipment-installations'
+
+class MirrorTests(unittest.TestCase):
+
+    def setUp(self):
+        # each test changes the data, so it gets its own server
+        self.server = MockSISServer(size=300, page_size=100).start()
+        self.client = SISClient(self.server.baseurl, 'token')
+        self.ei = EquipmentInstallation(client=self.client)
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmpdir.name, 'mirror.pkl')
+
+    def tearDown(self):
+        self.client.close()
+        self.server.stop()
+        self.tmpdir.cleanup()
+
+    def expected(self, filterby):
+        return {rec['id'] for rec in self.ei.iter_filtered(filterby)}
+
+    def add(self, netcode, ondate):
+        records = self.server.data[ENDPOINT]
+        rec = dict(records[0], id=str(int(records[-1]['id']) + 1))
+        rec['attributes'] = dict(rec['attributes'], netcode=netcode, ondate=ondate, offdate=None,
+                                 serialnumber=f'NEW{rec["id"]}')
+        records.append(rec)
+        self.server.index[ENDPOINT][rec['id']] = rec
+        return int(rec['id'])
+
+    def active(self, netcode):
+        return [rec for rec in self.server.data[ENDPOINT]
+                if rec['attributes']['netcode'] == netcode and rec['attributes']['offdate'] is None]
+
+    def test_delta_sync(self):
+        mirror = EndpointMirror(self.ei, self.path, filterby={'netcode': 'CI'})
+        stats = mirror.sync()
+        self.assertEqual(stats['mode'], 'full')
+        self.assertEqual(set(mirror.records), self.expected({'netcode': 'CI'}))
+
+        # a new installation after the watermark, one that was closed and one that was deleted
+        new = self.add('CI', (mirror.watermark + dt.timedelta(days=1)).isoformat())
+        closed, deleted = self.active('CI')[:2]
+        closed['attributes'] = dict(closed['attributes'], offdate='2020-01-01T00:00:00+00:00')
+        self.server.data[ENDPOINT].remove(deleted)
+        del self.server.index[ENDPOINT][deleted['id']]
+        self.server.changed()
+
+        mirror = EndpointMirror(self.ei, self.path, filterby={'netcode': 'CI'})
+        stats = mirror.sync()
+        self.assertEqual(stats['mode'], 'delta')
+        self.assertEqual(stats['added'], 1)
+        self.assertEqual(stats['refetched'], 1)
+        self.assertEqual(stats['deleted'], 1)
+        self.assertIn(new, mirror.records)
+        self.assertNotIn(int(deleted['id']), mirror.records)
+        self.assertIsNotNone(mirror.records[int(closed['id'])]['offdate'])
+        self.assertEqual(mirror.watermark, mirror.records[new]['ondate'])
+        self.assertEqual(set(mirror.records), self.expected({'netcode': 'CI'}))
+
+    def test_delta_sync_keeps_the_isactive_filter(self):
+        mirror = EndpointMirror(self.ei, self.path, filterby={'isactive': 'no'})
+        mirror.sync()
+        inactive = self.expected({'isactive': 'no'})
+        self.assertEqual(set(mirror.records), inactive)
+        stats = mirror.sync()
+        self.assertEqual(stats['mode'], 'delta')
+        self.assertEqual(stats['added'], 0)
+        self.assertEqual(set(mirror.records), inactive)
+
+if __name__ == '__main__':
+    unittest.main()